@@ -0,0 +1,187 @@
+# asr_backend.py
+# ASR 后端注册表：vad_asr 只认 ASRBackend 接口，具体引擎由 az_agent.yaml 的 asr 段选择。
+#   doubao  远端豆包（senddoubao：连接池 + 全双工会话，支持流式）
+#   local   本机 CPU 引擎：faster-whisper（CTranslate2 int8），模型从本地目录或缓存加载，离线可用
+#   hedged  对冲：主后端 hedge_budget_ms 内没回来（或已失败）就同时跑备后端，谁先成功用谁
+# 环境变量 ASR_BACKEND 优先于配置文件。
+
+import logging
+import os
+import threading
+import time
+
+import gevent
+from gevent.threadpool import ThreadPool
+
+from config_loader import config
+
+logger = logging.getLogger("asr_backend")
+
+_CFG = config.get("asr") or {}
+ASR_BACKEND = os.getenv("ASR_BACKEND", str(_CFG.get("backend", "doubao")))
+
+BACKENDS = {}
+
+
+def register(name: str):
+    def deco(cls):
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+    return deco
+
+
+class ASRBackend:
+    """
+    recognize_pcm(pcm, on_partial) -> str         16k/16bit/mono 裸 PCM 整句识别（在 greenlet 里调用）
+    recognize_ogg_opus(data, on_partial) -> str   仅 accepts_ogg_opus 为 True 时可用
+    stream(on_partial) -> 会话                    仅 supports_streaming 为 True 时可用，会话有 open/feed/finish/close
+    start()                                       服务启动时预热（建连接池 / 加载模型）
+    on_partial(text) 在引擎给出中间结果时回调；不出中间结果的引擎忽略它。
+    """
+
+    name = ""
+    accepts_ogg_opus = False
+    supports_streaming = False
+
+    def start(self):
+        pass
+
+    def recognize_pcm(self, pcm, on_partial=None) -> str:
+        raise NotImplementedError
+
+    def recognize_ogg_opus(self, data, on_partial=None) -> str:
+        raise NotImplementedError
+
+    def stream(self, on_partial=None):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+@register("doubao")
+class DoubaoBackend(ASRBackend):
+    accepts_ogg_opus = True
+    supports_streaming = True
+
+    def __init__(self, cfg: dict = None):
+        import senddoubao
+        self._sd = senddoubao
+
+    def start(self):
+        self._sd.start_pool()
+
+    def recognize_pcm(self, pcm, on_partial=None) -> str:
+        return self._sd.asr_pcm(pcm, on_partial)
+
+    def recognize_ogg_opus(self, data, on_partial=None) -> str:
+        return self._sd.asr_ogg_opus(data, on_partial)
+
+    def stream(self, on_partial=None):
+        return self._sd.StreamingASR(on_partial=on_partial)
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "pool": self._sd.pool_stats()}
+
+
+@register("local")
+class LocalWhisperBackend(ASRBackend):
+    """
+    faster-whisper 本地识别（可选依赖：pip install faster-whisper）。
+    推理在原生线程池里跑（CTranslate2 释放 GIL），不阻塞 gevent hub。
+    """
+
+    def __init__(self, cfg: dict = None):
+        cfg = cfg or {}
+        self.model_path = os.getenv("ASR_LOCAL_MODEL", str(cfg.get("local_model", "small")))
+        self.compute_type = str(cfg.get("local_compute_type", "int8"))
+        self.threads = int(cfg.get("local_threads", 4))
+        self.language = cfg.get("language", "zh")
+        self._pool = ThreadPool(int(cfg.get("local_workers", 1)))
+        self._model = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._pool.apply(self._load)
+
+    def _load(self):
+        with self._lock:
+            if self._model is None:
+                from faster_whisper import WhisperModel
+                t0 = time.perf_counter()
+                self._model = WhisperModel(self.model_path, device="cpu",
+                                           compute_type=self.compute_type, cpu_threads=self.threads)
+                logger.info("local ASR model %s loaded in %.1fs", self.model_path, time.perf_counter() - t0)
+        return self._model
+
+    def _transcribe(self, pcm) -> str:
+        import numpy as np
+        audio = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+        segments, _ = self._load().transcribe(audio, language=self.language, beam_size=1,
+                                              vad_filter=False, condition_on_previous_text=False)
+        return "".join(s.text for s in segments).strip()
+
+    def recognize_pcm(self, pcm, on_partial=None) -> str:
+        return self._pool.apply(self._transcribe, (pcm,))
+
+
+@register("hedged")
+class HedgedBackend(ASRBackend):
+    """
+    主后端先跑；超过 budget_ms 还没成功（或已经失败）才启动备后端，两个里先成功的胜出，另一个被取消。
+    只有慢尾部的句子才多花一次识别，p99 受 budget + 备后端耗时约束；主后端整体不可用时自动走备后端。
+    """
+
+    def __init__(self, cfg: dict = None):
+        cfg = cfg or {}
+        self.primary = make_backend(str(cfg.get("hedge_primary", "doubao")), cfg)
+        self.secondary = make_backend(str(cfg.get("hedge_secondary", "local")), cfg)
+        self.budget = float(os.getenv("ASR_HEDGE_BUDGET_MS", str(cfg.get("hedge_budget_ms", 1200)))) / 1000
+        self.requests = self.hedged = self.primary_wins = self.secondary_wins = 0
+
+    def start(self):
+        for b in (self.primary, self.secondary):
+            try:
+                b.start()
+            except Exception as e:
+                logger.error("ASR backend %s failed to start: %s", b.name, e)
+
+    def recognize_pcm(self, pcm, on_partial=None) -> str:
+        """中间结果只取主后端的，避免两个引擎的假设交替出现"""
+        self.requests += 1
+        first = gevent.spawn(self.primary.recognize_pcm, pcm, on_partial)
+        first.join(timeout=self.budget)
+        if first.successful():
+            self.primary_wins += 1
+            return first.value
+        self.hedged += 1
+        second = gevent.spawn(self.secondary.recognize_pcm, pcm)
+        jobs, exc = [first, second], None
+        while jobs:
+            done = gevent.wait(jobs, count=1)[0]
+            jobs.remove(done)
+            if done.successful():
+                for j in jobs:
+                    j.kill(block=False)
+                if done is first:
+                    self.primary_wins += 1
+                else:
+                    self.secondary_wins += 1
+                return done.value
+            exc = done.exception
+            logger.warning("hedged ASR: %s failed: %s", self.primary.name if done is first
+                           else self.secondary.name, exc)
+        raise exc
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "requests": self.requests, "hedged": self.hedged,
+                "primary_wins": self.primary_wins, "secondary_wins": self.secondary_wins,
+                "primary": self.primary.stats(), "secondary": self.secondary.stats()}
+
+
+def make_backend(name: str = ASR_BACKEND, cfg: dict = None) -> ASRBackend:
+    cfg = _CFG if cfg is None else cfg
+    if name not in BACKENDS:
+        raise ValueError(f"unknown ASR backend {name!r}, choose from {sorted(BACKENDS)}")
+    return BACKENDS[name](cfg)
@@ -0,0 +1,90 @@
+# audio_archive.py
+# 调试用音频归档：把每个 utterance 的 PCM 异步写成 wav，按数量 / 时长做保留策略。
+# 识别走内存 (senddoubao.asr_pcm)，归档只是旁路，写盘和清理都不在关键路径上。
+#   ASR_ARCHIVE_DIR       归档目录，留空则不归档
+#   ASR_ARCHIVE_MAX_FILES 最多保留多少个文件（默认 50）
+#   ASR_ARCHIVE_MAX_AGE   文件最长保留秒数（默认 3600）
+
+import os
+import queue
+import threading
+import time
+import uuid
+import wave
+import logging
+
+logger = logging.getLogger("AudioArchiver")
+
+ARCHIVE_DIR = os.getenv("ASR_ARCHIVE_DIR", "")
+ARCHIVE_MAX_FILES = int(os.getenv("ASR_ARCHIVE_MAX_FILES", "50"))
+ARCHIVE_MAX_AGE = float(os.getenv("ASR_ARCHIVE_MAX_AGE", "3600"))
+FILE_PREFIX = "asr_"
+
+
+class AudioArchiver(threading.Thread):
+    """独立线程：
+    1. 接收 (pcm, tag) 排队，submit() 立即返回
+    2. 写 <dir>/asr_<时间戳>_<tag>.wav
+    3. 只清理自己写出的 asr_*.wav：超过 max_age 的和超出 max_files 的最旧文件
+    """
+
+    def __init__(self,
+                 out_dir: str,
+                 max_files: int = ARCHIVE_MAX_FILES,
+                 max_age: float = ARCHIVE_MAX_AGE,
+                 rate: int = 16000,
+                 daemon: bool = True):
+        super().__init__(daemon=daemon)
+        self.out_dir = out_dir
+        self.max_files = max_files
+        self.max_age = max_age
+        self.rate = rate
+        self._q: "queue.Queue[tuple[bytes, str]]" = queue.Queue(maxsize=64)
+        os.makedirs(out_dir, exist_ok=True)
+        self.start()
+
+    # ------------  PUBLIC  -------------
+    def submit(self, pcm: bytes, tag: str = ""):
+        """线程安全；队列满时丢弃本条而不是阻塞调用方"""
+        try:
+            self._q.put_nowait((bytes(pcm), tag or uuid.uuid4().hex[:8]))
+        except queue.Full:
+            logger.warning("archive queue full, drop one utterance")
+
+    # ------------  THREAD LOOP  --------
+    def run(self):
+        while True:
+            pcm, tag = self._q.get()
+            try:
+                self._write(pcm, tag)
+                self._apply_retention()
+            except Exception as e:
+                logger.error("archive failed: %s", e, exc_info=True)
+
+    # ------------  INTERNAL  -----------
+    def _write(self, pcm: bytes, tag: str):
+        name = f"{FILE_PREFIX}{time.strftime('%Y%m%d_%H%M%S')}_{tag}.wav"
+        with wave.open(os.path.join(self.out_dir, name), "wb") as wf:
+            wf.setnchannels(1); wf.setsampwidth(2); wf.setframerate(self.rate)
+            wf.writeframes(pcm)
+
+    def _apply_retention(self):
+        now = time.time()
+        files = []
+        for fn in os.listdir(self.out_dir):
+            if fn.startswith(FILE_PREFIX) and fn.endswith(".wav"):
+                p = os.path.join(self.out_dir, fn)
+                files.append((os.path.getmtime(p), p))
+        files.sort()
+        expired = [p for mtime, p in files if now - mtime > self.max_age]
+        overflow = [p for _, p in files[:max(len(files) - self.max_files, 0)]]
+        for p in set(expired) | set(overflow):
+            try:
+                os.remove(p)
+            except OSError as e:
+                logger.warning("rm %s fail: %s", p, e)
+
+
+def make_archiver():
+    """按环境变量创建归档器；未配置目录时返回 None"""
+    return AudioArchiver(ARCHIVE_DIR) if ARCHIVE_DIR else None
@@ -0,0 +1,82 @@
+# audio_buffer.py
+# 每连接固定容量的 PCM 采集缓冲：带 pre-roll、零拷贝视图、硬上限。
+#   UTT_MAX_MS      单个 utterance 最长毫秒数（默认 20000），到达后由调用方强制端点
+#   UTT_PREROLL_MS  开口前保留的音频毫秒数（默认 500），补回 VAD 判定窗口里丢掉的起音
+
+import os
+
+UTT_MAX_MS = int(os.getenv("UTT_MAX_MS", "20000"))
+UTT_PREROLL_MS = int(os.getenv("UTT_PREROLL_MS", "500"))
+
+
+class UtteranceBuffer:
+    """
+    一次性分配的 bytearray，容量 = pre-roll + 最长 utterance，连接生命周期内不再扩容。
+    - 空闲时 write() 只需保留最近 preroll 字节：写到底就把尾部 preroll 搬回开头（均摊 O(1)）；
+    - start() 开始采集，已缓存的 pre-roll 成为 utterance 开头，之后线性追加；
+    - view() 返回当前 utterance 的 memoryview（零拷贝），take() 拷出 bytes 并回到空闲；
+    - 采集中写满容量后 full 为 True，多余数据被丢弃，调用方应立即端点。
+    缓冲从不改变长度，所以对外导出的 memoryview 不会阻塞后续写入；
+    但 take()/reset() 之后旧视图的内容会被新音频覆盖，跨 greenlet 交付请用 take()。
+    """
+
+    def __init__(self, max_ms: int = UTT_MAX_MS, preroll_ms: int = UTT_PREROLL_MS,
+                 rate: int = 16000, sample_width: int = 2):
+        bytes_per_ms = rate * sample_width // 1000
+        self.preroll = preroll_ms * bytes_per_ms
+        self.capacity = self.preroll + max_ms * bytes_per_ms
+        self._buf = bytearray(self.capacity)
+        self._start = 0
+        self._end = 0
+        self.capturing = False
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    @property
+    def full(self) -> bool:
+        return self.capturing and self._end >= self.capacity
+
+    def write(self, data) -> int:
+        """追加 PCM，返回实际写入的字节数（采集写满时可能小于 len(data)）"""
+        n = len(data)
+        if not self.capturing:
+            if n >= self.preroll:
+                self._buf[:self.preroll] = data[n - self.preroll:]
+                self._end = self.preroll
+                return n
+            if self._end + n > self.capacity:
+                self._compact()
+        else:
+            n = min(n, self.capacity - self._end)
+            data = data[:n]
+        self._buf[self._end:self._end + n] = data
+        self._end += n
+        return n
+
+    def start(self, preroll: bool = True):
+        """开始采集：最近 preroll 字节作为 utterance 开头；preroll=False 时从空缓冲开始"""
+        if preroll:
+            self._compact()
+        else:
+            self._end = 0
+        self._start = 0
+        self.capturing = True
+
+    def view(self) -> memoryview:
+        return memoryview(self._buf)[self._start:self._end]
+
+    def take(self) -> bytes:
+        """拷出当前 utterance 并回到空闲；utterance 尾部继续充当下一句的 pre-roll"""
+        pcm = bytes(self.view())
+        self.reset()
+        return pcm
+
+    def reset(self):
+        self.capturing = False
+        self._start = 0
+
+    def _compact(self):
+        keep = min(self.preroll, self._end)
+        self._buf[:keep] = self._buf[self._end - keep:self._end]
+        self._end = keep
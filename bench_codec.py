@@ -0,0 +1,139 @@
+# bench_codec.py
+# doubao_codec 自检 + 吞吐基准：
+#   1. 往返：所有消息类型 × flags × 压缩方式，编码后解码字段与负载一致；
+#   2. 模糊：随机截断 / 翻转字节，decode 只允许成功或抛 CodecError；
+#   3. 吞吐：200ms 音频包的编码 / 解码、约 150B 的服务端响应解码的 ns/帧与每帧临时分配字节（tracemalloc 峰值），
+#      对比改动前的 header + size + payload 拼接与切片；另列 gzip 压缩策略下整包编码的分配（压缩结果每包新分配）。
+#   python bench_codec.py [frames]
+
+import gzip
+import json
+import os
+import random
+import struct
+import sys
+import time
+import tracemalloc
+
+import doubao_codec as dc
+
+N_FRAMES = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+PACKET = 6400
+
+
+def check_roundtrip():
+    rng = random.Random(0)
+    n = 0
+    for msg_type in (dc.MSG_FULL_CLIENT, dc.MSG_AUDIO_ONLY, dc.MSG_FULL_SERVER, dc.MSG_SERVER_ACK):
+        for flags in (dc.FLAG_NONE, dc.FLAG_POS_SEQ, dc.FLAG_LAST, dc.FLAG_NEG_SEQ):
+            for comp in (dc.COMP_NONE, dc.COMP_GZIP):
+                for size in (0, 1, 255, PACKET):
+                    raw = os.urandom(size)
+                    body = gzip.compress(raw) if comp == dc.COMP_GZIP else raw
+                    seq = None
+                    if flags & dc.FLAG_POS_SEQ:
+                        seq = -rng.randint(1, 2**31 - 1) if flags & dc.FLAG_LAST else rng.randint(1, 2**31 - 1)
+                    for buf in (dc.encode(msg_type, body, flags, dc.SER_NONE, comp, seq),
+                                bytes(dc.FrameEncoder(64).encode(msg_type, body, flags, dc.SER_NONE, comp, seq))):
+                        f = dc.decode(buf)
+                        assert (f.msg_type, f.flags, f.compression, f.sequence) == (msg_type, flags, comp, seq)
+                        assert f.data() == raw and f.last == bool(flags & dc.FLAG_LAST)
+                        n += 1
+    err = dc.decode(dc.encode_error(45000081, "音频过长"))
+    assert err.is_error and err.json() == {"code": 45000081, "message": "音频过长"}
+    resp = {"code": 1000, "sequence": 3, "result": [{"text": "你好"}]}
+    f = dc.decode(dc.encode(dc.MSG_FULL_SERVER, json.dumps(resp).encode(), dc.FLAG_LAST, dc.SER_JSON))
+    assert dc.server_sequence(f, f.json()) == -3
+    return n + 2
+
+
+def check_fuzz(rounds: int = 20000):
+    rng = random.Random(1)
+    seeds = [bytes(dc.encode(t, os.urandom(rng.randint(0, 64)), fl, sequence=7))
+             for t in dc.MESSAGE_TYPES[:4] for fl in (dc.FLAG_POS_SEQ, dc.FLAG_NEG_SEQ)]
+    seeds.append(bytes(dc.encode_error(1, "x")))
+    ok = bad = 0
+    for _ in range(rounds):
+        b = bytearray(rng.choice(seeds))
+        if rng.random() < 0.5:
+            b = b[:rng.randint(0, len(b))]
+        for _ in range(rng.randint(0, 3)):
+            if b:
+                b[rng.randrange(len(b))] = rng.randrange(256)
+        try:
+            f = dc.decode(b)
+            assert len(f.payload) <= len(b)
+            ok += 1
+        except dc.CodecError:
+            bad += 1
+    return ok, bad
+
+
+def legacy_encode(chunk, last):
+    """改动前 senddoubao 的做法：make_header + struct.pack + 拼接"""
+    flags = 0b0010 if last else 0b0000
+    hdr = bytes([0x11, (2 << 4) | flags, 0x00, 0x00])
+    return hdr + struct.pack(">I", len(chunk)) + chunk
+
+
+def legacy_decode(msg):
+    size = struct.unpack(">I", msg[4:8])[0]
+    return msg[8:8 + size]
+
+
+def legacy_receive(msg):
+    """改动前 senddoubao 收包时实际做的：取类型 / flags / 压缩位，切出负载再 bytes() 一次"""
+    msg_type, flags = msg[1] >> 4, msg[1] & 0xF
+    compression = msg[2] & 0xF
+    size = struct.unpack(">I", msg[4:8])[0]
+    return msg_type, flags, compression, bytes(msg[8:8 + size])
+
+
+def timeit(fn, n):
+    t0 = time.perf_counter_ns()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter_ns() - t0) / n
+
+
+def alloc_per_call(fn, n: int = 200):
+    tracemalloc.start()
+    total = 0
+    for _ in range(n):
+        base, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        total += peak - base
+    tracemalloc.stop()
+    return total / n
+
+
+if __name__ == "__main__":
+    print(f"round-trip: {check_roundtrip()} frames ok")
+    ok, bad = check_fuzz()
+    print(f"fuzz: {ok} decoded, {bad} rejected with CodecError, 0 other exceptions")
+
+    import senddoubao
+    chunk = os.urandom(PACKET)
+    pcm = (bytes(range(256)) * (PACKET // 256 + 1))[:PACKET]   # 可压缩的负载，gzip 才有意义
+    enc = dc.FrameEncoder()
+    gz = senddoubao.CompressionPolicy("gzip")
+    frame = bytes(dc.encode(dc.MSG_AUDIO_ONLY, chunk))
+    resp = json.dumps({"code": 1000, "sequence": 3, "result": [{"text": "今天天气怎么样" * 4}]}).encode()
+    small = bytes(dc.encode(dc.MSG_FULL_SERVER, gzip.compress(resp), dc.FLAG_NONE, dc.SER_JSON, dc.COMP_GZIP))
+    rows = [
+        ("legacy concat encode", PACKET, lambda: legacy_encode(chunk, False)),
+        ("dc.encode", PACKET, lambda: dc.encode(dc.MSG_AUDIO_ONLY, chunk)),
+        ("FrameEncoder.encode", PACKET, lambda: enc.encode(dc.MSG_AUDIO_ONLY, chunk)),
+        ("gzip + FrameEncoder", PACKET, lambda: senddoubao.build_audio_request(pcm, 1, False, gz, enc)),
+        ("legacy slice decode", PACKET, lambda: legacy_decode(frame)),
+        ("legacy receive decode", PACKET, lambda: legacy_receive(frame)),
+        ("dc.decode", PACKET, lambda: dc.decode(frame)),
+        ("legacy receive (resp)", len(small), lambda: legacy_receive(small)),
+        ("dc.decode (resp)", len(small), lambda: dc.decode(small)),
+    ]
+    print(f"{'path':<24}{'ns/frame':>12}{'MB/s':>10}{'alloc B/frame':>16}")
+    for name, size, fn in rows:
+        ns = timeit(fn, N_FRAMES)
+        print(f"{name:<24}{ns:>12.0f}{size / ns * 1e3:>10.0f}{alloc_per_call(fn):>16.0f}")
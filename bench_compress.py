@@ -0,0 +1,56 @@
+# bench_compress.py
+# 豆包上行音频包的压缩策略基准：每包 CPU 耗时 (µs) 与省下的字节比例。
+# 语料是 test.wav 的语音段加上底噪静音，按 CHUNK_MS 切包，和线上上传的包一样大。
+#   python bench_compress.py [repeat]
+
+import gzip
+import sys
+import time
+import wave
+
+import numpy as np
+
+from senddoubao import CompressionPolicy, CHUNK_BYTES
+
+REPEAT = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+
+def make_packets():
+    with wave.open("test.wav") as w:
+        speech = w.readframes(w.getnframes())
+    rng = np.random.default_rng(0)
+    silence = (rng.standard_normal(16000 * 2) * 30).astype(np.int16).tobytes()
+    pcm = silence + speech + silence
+    return [pcm[i:i + CHUNK_BYTES] for i in range(0, len(pcm), CHUNK_BYTES)]
+
+
+class LegacyGzip:
+    """改动前的做法：每包 gzip.compress（默认 level 9）"""
+    def encode(self, data):
+        return 1, gzip.compress(data)
+
+
+def bench(policy, packets):
+    for p in packets[:5]:
+        policy.encode(p)
+    t0 = time.perf_counter()
+    for _ in range(REPEAT):
+        for p in packets:
+            policy.encode(p)
+    us = (time.perf_counter() - t0) / (REPEAT * len(packets)) * 1e6
+    raw = sum(len(p) for p in packets)
+    out = sum(len(policy.encode(p)[1]) for p in packets)
+    plain = sum(1 for p in packets if policy.encode(p)[0] == 0)
+    return us, 1 - out / raw, plain
+
+
+if __name__ == "__main__":
+    packets = make_packets()
+    print(f"{len(packets)} packets x {CHUNK_BYTES} B")
+    print(f"{'policy':<22}{'µs/packet':>12}{'saved':>10}{'raw pkts':>10}")
+    cases = [("gzip.compress L9", LegacyGzip()), ("off", CompressionPolicy("off"))]
+    cases += [(f"gzip L{lv}", CompressionPolicy("gzip", level=lv)) for lv in (1, 6, 9)]
+    cases += [("adaptive L1", CompressionPolicy("adaptive", level=1))]
+    for name, policy in cases:
+        us, saved, plain = bench(policy, packets)
+        print(f"{name:<22}{us:>12.1f}{saved:>10.1%}{plain:>10}")
@@ -0,0 +1,65 @@
+# bench_intent.py
+# 本地意图预分类的离线评估：intent_phrases.tsv 做 K 折交叉验证（工具 docstring 始终参与训练），
+# 报告“跳过 LLM”决策的 precision / recall、被误跳过的工具指令数，以及每句省下的期望延迟。
+# 工具 docstring 用 ast 从 camelfunc.py 里读，不需要装 CAMEL 也不调用任何 LLM。
+#   python bench_intent.py [llm_ms] [chat_share]
+#     llm_ms      一次 CAMEL agent.step 的往返耗时（默认 800ms，按线上 [timing] 日志的 intent 填）
+#     chat_share  线上流量里闲聊（无工具）句子的占比（默认 0.9），用于换算实际节省
+
+import ast
+import sys
+import time
+
+from intent_classifier import IntentClassifier, NONE, PINYIN_AVAILABLE, load_phrases
+
+LLM_MS = float(sys.argv[1]) if len(sys.argv) > 1 else 800.0
+CHAT_SHARE = float(sys.argv[2]) if len(sys.argv) > 2 else 0.9
+FOLDS = 5
+
+
+def tool_docstrings(path: str = "camelfunc.py") -> dict:
+    tree = ast.parse(open(path, encoding="utf-8").read())
+    names = set()
+    for node in tree.body:
+        if isinstance(node, ast.AnnAssign) and getattr(node.target, "id", "") == "TOOL_MAP":
+            names = {k.value for k in node.value.keys}
+    return {n.name: ast.get_docstring(n) or "" for n in tree.body
+            if isinstance(n, ast.FunctionDef) and n.name in names}
+
+
+def evaluate(samples, docs, threshold: float):
+    tp = fp = fn = tools_missed = 0
+    us = []
+    for k in range(FOLDS):
+        train = [s for i, s in enumerate(samples) if i % FOLDS != k]
+        test = [s for i, s in enumerate(samples) if i % FOLDS == k]
+        clf = IntentClassifier(skip_threshold=threshold).fit(train, docs)
+        for label, text in test:
+            t0 = time.perf_counter()
+            skip = clf.decide(text)[0]
+            us.append((time.perf_counter() - t0) * 1e6)
+            if skip and label == NONE:
+                tp += 1
+            elif skip:
+                fp += 1
+                tools_missed += 1
+                print(f"  !! 误跳过 [{label}] {text}")
+            elif label == NONE:
+                fn += 1
+    precision = tp / (tp + fp) if tp + fp else 1.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    return precision, recall, tools_missed, sum(us) / len(us)
+
+
+if __name__ == "__main__":
+    samples = load_phrases()
+    docs = tool_docstrings()
+    n_none = sum(1 for label, _ in samples if label == NONE)
+    print(f"语料 {len(samples)} 句（none {n_none}，工具 {len(samples) - n_none}），{FOLDS} 折交叉验证，"
+          f"pinyin={'on' if PINYIN_AVAILABLE else 'off'}，LLM {LLM_MS:.0f}ms，闲聊占比 {CHAT_SHARE:.0%}")
+    print(f"{'threshold':>9} | {'precision':>9} | {'recall':>6} | {'误跳过':>4} | {'分类 µs':>7} | {'省 ms/句':>8}")
+    for threshold in (0.8, 0.9, 0.95, 0.99):
+        p, r, missed, us = evaluate(samples, docs, threshold)
+        # 只有闲聊句会被跳过：期望节省 = 闲聊占比 × 跳过率 × LLM 往返 − 每句都要付的分类耗时
+        saved = CHAT_SHARE * r * LLM_MS - us / 1000
+        print(f"{threshold:>9} | {p:>9.3f} | {r:>6.3f} | {missed:>6} | {us:>7.1f} | {saved:>8.0f}")
@@ -0,0 +1,62 @@
+# bench_vad.py
+# SileroVAD 热路径微基准：对比默认实现与零分配模式 (VAD_ZERO_ALLOC) 的
+# 每 chunk 耗时 (ns) 与每 chunk 临时分配字节数 (tracemalloc 峰值)。
+#   python bench_vad.py [chunks]
+
+import os
+import sys
+import time
+import tracemalloc
+
+# 只测推理热路径本身，不经过 VAD 线程池
+os.environ.setdefault("VAD_WORKERS", "0")
+os.environ.setdefault("VAD_BATCHING", "0")
+
+import numpy as np
+
+from vad_asr import SileroVAD, ZeroAllocSileroVAD, _CHUNK_SAMPLES
+
+N_CHUNKS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+ALLOC_CHUNKS = 200
+
+
+def make_chunks(n: int):
+    rng = np.random.default_rng(0)
+    return [(rng.standard_normal(_CHUNK_SAMPLES) * 3000).astype(np.int16).tobytes()
+            for _ in range(n)]
+
+
+def bench(vad: SileroVAD, chunks):
+    # 预热：建 session、首帧 kernel 选择
+    for c in chunks[:20]:
+        vad.speech_prob(c)
+
+    t0 = time.perf_counter_ns()
+    for c in chunks:
+        vad.speech_prob(c)
+    ns = (time.perf_counter_ns() - t0) / len(chunks)
+
+    # 分配：每个 chunk 前重置峰值，累计 (峰值 - 基线)
+    tracemalloc.start()
+    total = 0
+    for c in chunks[:ALLOC_CHUNKS]:
+        base, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        vad.speech_prob(c)
+        _, peak = tracemalloc.get_traced_memory()
+        total += peak - base
+    tracemalloc.stop()
+    return ns, total / ALLOC_CHUNKS
+
+
+if __name__ == "__main__":
+    chunks = make_chunks(N_CHUNKS)
+    ref, zero = SileroVAD(), ZeroAllocSileroVAD()
+    probs_ref = [ref.speech_prob(c) for c in chunks[:50]]
+    probs_zero = [zero.speech_prob(c) for c in chunks[:50]]
+    print(f"max |Δprob| over 50 chunks: {max(abs(a - b) for a, b in zip(probs_ref, probs_zero)):.2e}")
+
+    print(f"{'impl':<22}{'ns/chunk':>12}{'alloc B/chunk':>16}")
+    for name, cls in (("SileroVAD", SileroVAD), ("ZeroAllocSileroVAD", ZeroAllocSileroVAD)):
+        ns, alloc = bench(cls(), chunks)
+        print(f"{name:<22}{ns:>12.0f}{alloc:>16.1f}")
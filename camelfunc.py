@@ -13,8 +13,15 @@ from __future__ import annotations
 import json
 import logging
 import os
+import queue
 import sys
+import re
 import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
 from typing import Any, Dict
 from types import SimpleNamespace
 
@@ -26,9 +33,12 @@ from camel.models import ModelFactory
 from camel.toolkits import FunctionTool
 from camel.types import ModelPlatformType
 
+from config_loader import config
 from emotion_controller import EmotionController
-from llm_client import chat_with_dify
+from intent_classifier import INTENT_FASTPATH, IntentClassifier
+from llm_client import DIFY_STREAMING, chat_stream_dify, chat_with_dify
 from memorymanager import append_memory
+import event_bus
 
 # 在文件顶部导入mem0管理器
 from mem0_manager import Mem0Manager
@@ -129,20 +139,75 @@ TOOL_MAP: Dict[str, Any] = {
     "screenshot": screenshot,
     "recite_poem": recite_poem,
 }
+# 本地意图预分类：确定是闲聊的句子不必让 CAMEL 跑一次 LLM
+intent_clf = IntentClassifier.from_tools(TOOL_MAP)
 
 # System prompt
 SYSTEM_PROMPT = (
     ""
 )
 
-# Agent
-agent = ChatAgent(
-    model=volc_model,
-    tools=[music_tool, screenshot_tool, poem_tool],
-    system_message=SYSTEM_PROMPT,
-    memory=None,
-)
-llm_lock = threading.Lock()
+# Agent pool
+AGENT_POOL_SIZE = int(os.getenv("CAMEL_AGENT_POOL", str((config.get("camelfunc") or {}).get("agent_pool_size", 4))))
+
+
+def _new_agent() -> ChatAgent:
+    return ChatAgent(
+        model=volc_model,
+        tools=[music_tool, screenshot_tool, poem_tool],
+        system_message=SYSTEM_PROMPT,
+        memory=None,
+    )
+
+
+class AgentPool:
+    """
+    预先建好的 ChatAgent 池，取代全局 agent + llm_lock：每次工具判断借出一个，用完归还。
+    ChatAgent 带会话状态，不能多线程共用同一个；池空时排队，排队耗时计入 stats()，用来判断池子是否够大。
+    """
+
+    def __init__(self, factory, size: int):
+        self.size = max(1, size)
+        self._idle: "queue.Queue[ChatAgent]" = queue.Queue()
+        for _ in range(self.size):
+            self._idle.put(factory())
+        self._lock = threading.Lock()
+        self.checkouts = self.waited = 0
+        self.wait_ms_total = self.wait_ms_max = 0.0
+
+    @contextmanager
+    def agent(self):
+        t = time.perf_counter()
+        try:
+            a = self._idle.get_nowait()
+        except queue.Empty:
+            a = self._idle.get()
+            wait_ms = (time.perf_counter() - t) * 1000
+            logger.info("agent pool exhausted, waited %.0fms", wait_ms)
+            with self._lock:
+                self.waited += 1
+                self.wait_ms_total += wait_ms
+                self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+        with self._lock:
+            self.checkouts += 1
+        try:
+            yield a
+        finally:
+            self._idle.put(a)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": self.size, "idle": self._idle.qsize(), "checkouts": self.checkouts,
+                    "waited": self.waited,
+                    "avg_wait_ms": round(self.wait_ms_total / self.checkouts, 1) if self.checkouts else 0.0,
+                    "max_wait_ms": round(self.wait_ms_max, 1)}
+
+
+agent_pool = AgentPool(_new_agent, AGENT_POOL_SIZE)
+
+
+def intent_stats() -> dict:
+    return {"pool": agent_pool.stats(), "fastpath": intent_clf.stats()}
 em_ctrl = EmotionController()
 
 # Extract tool calls
@@ -170,6 +235,95 @@ def _extract_tool_calls(res: Any):
     return []
 
 
+def _classify(user_text: str):
+    """CAMEL 工具选择：从池里借一个 agent，清空上一轮状态后 step，返回 step 结果"""
+    with agent_pool.agent() as agent:
+        agent.reset()
+        return agent.step(user_text)
+
+
+# ────────────────────────────────────────────────────────────────────────────
+# Speculative intent: 端点一到就拿最新的中间识别结果先跑工具选择，
+# 最终文本（去掉标点空白后）一致时 handle_user_text 直接复用，省掉一次串行 LLM 往返。
+# 只在 speech_end 时投机一次，不对每个 asr_partial 都发 LLM 请求。
+# 依赖流式识别（ASR_STREAMING=1，与 vad_asr 同一个环境变量）：整句识别要到端点之后才开始，
+# speech_end 时还没有中间结果，投机永远不会发生，所以未开流式时不订阅。
+# ────────────────────────────────────────────────────────────────────────────
+
+SPECULATE = os.getenv("SPECULATE", "1") == "1" and os.getenv("ASR_STREAMING", "0") == "1"
+SPECULATE_MIN_CHARS = int(os.getenv("SPECULATE_MIN_CHARS", "4"))
+_SPEC_MAX = 32
+_speculative: "OrderedDict[str, Any]" = OrderedDict()
+_spec_lock = threading.Lock()
+_spec_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="speculate")
+_PUNCT = re.compile(r"[\s\W_]+", re.UNICODE)
+
+
+def _norm(text: str) -> str:
+    return _PUNCT.sub("", text or "").lower()
+
+
+def _on_speech_end(session: str, text: str):
+    key = _norm(text)
+    if len(key) < SPECULATE_MIN_CHARS or _fastpath_skip(text, record=False):
+        return
+    with _spec_lock:
+        if key in _speculative:
+            return
+        _speculative[key] = _spec_pool.submit(_classify, text)
+        while len(_speculative) > _SPEC_MAX:
+            _speculative.popitem(last=False)
+
+
+def _take_speculative(user_text: str):
+    with _spec_lock:
+        return _speculative.pop(_norm(user_text), None)
+
+
+def _fastpath_skip(user_text: str, record: bool = True) -> bool:
+    if not INTENT_FASTPATH:
+        return False
+    skip, label, p_none, reason = intent_clf.decide(user_text, record)
+    if record:
+        logger.info("intent fast-path: %s (%s, %s, p_none=%.3f)", "skip" if skip else "camel", reason, label, p_none)
+    return skip
+
+
+def _intent(user_text: str):
+    """
+    本地预分类确定无工具时返回 None，不调 LLM；
+    否则端点时已投机跑过同一句就直接用，失败再正常跑一次。
+    """
+    if _fastpath_skip(user_text):
+        _take_speculative(user_text)
+        return None
+    fut = _take_speculative(user_text)
+    if fut is not None:
+        try:
+            res = fut.result()
+            logger.info("speculative intent hit: %s", user_text)
+            return res
+        except Exception as e:
+            logger.warning("speculative intent failed: %s", e)
+    return _classify(user_text)
+
+
+# 回复生成与工具判断并发时，回复在这个池里跑，工具判断留在调用线程
+_stage_pool = ThreadPoolExecutor(max_workers=int(os.getenv("REPLY_WORKERS", "8")), thread_name_prefix="reply")
+
+
+def _timed(timing: Dict[str, float], stage: str, fn, *args, **kwargs):
+    t = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        timing[stage] = (time.perf_counter() - t) * 1000
+
+
+if SPECULATE:
+    event_bus.subscribe("speech_end", _on_speech_end)
+
+
 # ────────────────────────────────────────────────────────────────────────────
 # Main entry: handle_user_text
 # ────────────────────────────────────────────────────────────────────────────
@@ -210,40 +364,57 @@ from mem0_manager import Mem0Manager
 mem0_mgr = None
 
 # 在 handle_user_text 函数中初始化 mem0 管理器
-def handle_user_text(user_text: str, ws, session_id: str = "user123") -> None:
+def handle_user_text(user_text: str, ws, session_id: str = "user123", conn_session: str = None) -> None:
+    """
+    session_id 是 Dify user / 工具 identifier；conn_session 是发起这句话的连接的 session id
+    （与 asr_partial / speech_end 相同），reply_sentence 事件用它标注来源连接。
+    """
     global mem0_mgr
     
     # 初始化 mem0 管理器（如果尚未初始化）
     if mem0_mgr is None:
         mem0_mgr = Mem0Manager(local_mode=True)  # 或者使用 API 密钥
     
-    # 调用 chat_with_dify 处理对话
-    chat_with_dify(user_text, user_id=session_id, ws=ws)
-    
-    # CAMEL 请求处理...（保持原有代码不变）
-    # CAMEL request
-    with llm_lock:
-        agent.reset()
-        res = agent.step(user_text)
-    calls = _extract_tool_calls(res)
-    # logger.info(f"{res}")
-    logger.info("Extracted tool_calls: %s", calls)
-
-    if calls:
-        call = calls[0]
-        name = getattr(call, "name", None) or getattr(call, "tool_name", None)
-        args = getattr(call, "arguments", None) or getattr(call, "args", {})
-        if isinstance(args, str):
-            try:
-                args = json.loads(args)
-            except:
-                pass
-        # inject identifier
-        if name in ("play_music","screenshot") and not args.get("identifier"):
-            args["identifier"] = session_id
-        logger.info("Executing %s with %s", name, args)
-        result = TOOL_MAP.get(name, lambda **_: "")( **args)
-        payload = {"label":"function","name":name,"arguments":args,"result":result}
-        ws.send(json.dumps(payload, ensure_ascii=False))
-        #如果llm_funcsametime为True，则直接返回
+    t0 = time.perf_counter()
+    timing: Dict[str, float] = {}
+    # llm_funcsametime 为 True 时回复和工具判断同时发出：工具结果一到就执行并推送，不必等整段人设回复
+    # DIFY_STREAMING：回复按 SSE 增量推 chat_delta / chat_sentence，首字延迟见 llm_client.stream_stats()
+    chat = partial(chat_stream_dify, session=conn_session) if DIFY_STREAMING else chat_with_dify
+    reply = None
+    if llm_funcsametime:
+        reply = _stage_pool.submit(_timed, timing, "reply", chat, user_text, user_id=session_id, ws=ws)
+    else:
+        _timed(timing, "reply", chat, user_text, user_id=session_id, ws=ws)
 
+    try:
+        res = _timed(timing, "intent", _intent, user_text)
+        calls = _extract_tool_calls(res) if res is not None else []
+        logger.info("Extracted tool_calls: %s", calls)
+
+        if calls:
+            call = calls[0]
+            name = getattr(call, "name", None) or getattr(call, "tool_name", None)
+            args = getattr(call, "arguments", None) or getattr(call, "args", {})
+            if isinstance(args, str):
+                try:
+                    args = json.loads(args)
+                except:
+                    pass
+            # inject identifier
+            if name in ("play_music","screenshot") and not args.get("identifier"):
+                args["identifier"] = session_id
+            logger.info("Executing %s with %s", name, args)
+            result = _timed(timing, "tool", TOOL_MAP.get(name, lambda **_: ""), **args)
+            payload = {"label":"function","name":name,"arguments":args,"result":result}
+            ws.send(json.dumps(payload, ensure_ascii=False))
+            timing["function_sent"] = (time.perf_counter() - t0) * 1000
+    finally:
+        # 回复的异常在这里抛给调用方；工具已先行推送
+        try:
+            if reply is not None:
+                reply.result()
+        finally:
+            total = (time.perf_counter() - t0) * 1000
+            overlap = timing.get("reply", 0) + timing.get("intent", 0) - total if reply is not None else 0
+            logger.info("[timing] %s total=%.0fms overlap=%.0fms",
+                        " ".join(f"{k}={v:.0f}ms" for k, v in timing.items()), total, max(overlap, 0))
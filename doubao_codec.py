@@ -0,0 +1,224 @@
+# doubao_codec.py
+# 豆包 ASR 二进制帧编解码：4 字节头（可带扩展头）+ 可选 sequence + 负载长度 + 负载。
+#   byte0  version(4) | header_size(4, 以 4 字节为单位)
+#   byte1  message_type(4) | flags(4)
+#   byte2  serialization(4) | compression(4)
+#   byte3  reserved
+# flags 的 bit0 表示头后带 int32 sequence，bit1 表示最后一包；错误帧是 error_code + 消息长度 + UTF-8 消息。
+# 编码用 struct.pack_into 写进预分配缓冲；解码对常见形状一次 unpack + 一次查表，bytearray / memoryview 输入只切视图。
+# 实测（bench_codec.py）见 README：省的是每帧分配，纯 Python 下单帧耗时与原先的切片拼接持平或略高。
+
+import json
+import struct
+import zlib
+from collections import namedtuple
+
+VERSION = 0b0001
+HEADER_SIZE = 4
+
+MSG_FULL_CLIENT  = 0b0001
+MSG_AUDIO_ONLY   = 0b0010
+MSG_FULL_SERVER  = 0b1001
+MSG_SERVER_ACK   = 0b1011
+MSG_SERVER_ERROR = 0b1111
+MESSAGE_TYPES = (MSG_FULL_CLIENT, MSG_AUDIO_ONLY, MSG_FULL_SERVER, MSG_SERVER_ACK, MSG_SERVER_ERROR)
+_MESSAGE_TYPES = frozenset(MESSAGE_TYPES)
+
+FLAG_NONE     = 0b0000
+FLAG_POS_SEQ  = 0b0001   # 带正 sequence
+FLAG_LAST     = 0b0010   # 最后一包，不带 sequence
+FLAG_NEG_SEQ  = 0b0011   # 最后一包，带负 sequence
+
+SER_NONE = 0b0000
+SER_JSON = 0b0001
+
+COMP_NONE = 0b0000
+COMP_GZIP = 0b0001
+
+_HDR = struct.Struct(">BBBB")
+_HDR_LEN = struct.Struct(">BBBBI")        # 头 + 负载长度
+_HDR_SEQ_LEN = struct.Struct(">BBBBiI")   # 头 + sequence + 负载长度
+_I32 = struct.Struct(">i")
+_U32 = struct.Struct(">I")
+_HEAD_LEN = struct.Struct(">II")          # 头（当作一个 u32）+ 负载长度
+_B0 = (VERSION << 4) | (HEADER_SIZE // 4)
+_new = tuple.__new__
+
+
+class CodecError(ValueError):
+    """帧不完整或字段非法"""
+
+
+class Frame(namedtuple("Frame", "msg_type flags serialization compression sequence payload error_code",
+                       defaults=(None,))):
+    """
+    解码结果（不可变）。bytes 输入的 payload 是切片拷贝——服务端响应只有几百字节，拷贝比建 memoryview 还便宜；
+    bytearray / memoryview 输入的 payload 是指向原消息的 memoryview（原消息存活期间有效）。
+    错误帧的 error_code 非 None，payload 是错误消息。
+    """
+
+    __slots__ = ()
+
+    @property
+    def is_error(self) -> bool:
+        return self.msg_type == MSG_SERVER_ERROR
+
+    @property
+    def last(self) -> bool:
+        """头部标记的最后一包（FLAG_LAST / FLAG_NEG_SEQ，或 sequence 为负）"""
+        return bool(self.flags & FLAG_LAST) or (self.sequence is not None and self.sequence < 0)
+
+    def data(self) -> bytes:
+        if self.compression == COMP_GZIP:
+            return zlib.decompress(self.payload, 47)   # 47: 自动识别 gzip / zlib 头
+        return bytes(self.payload)
+
+    def json(self) -> dict:
+        if self.is_error:
+            return {"code": self.error_code, "message": self.data().decode("utf-8", errors="ignore")}
+        return json.loads(self.data().decode("utf-8", errors="ignore")) if len(self.payload) else {}
+
+
+def encode_into(buf, msg_type: int, payload, flags: int = FLAG_NONE, serialization: int = SER_NONE,
+                compression: int = COMP_NONE, sequence: int = None) -> int:
+    """把一帧写进 buf（bytearray / 可写 memoryview）开头，返回写入的字节数"""
+    if msg_type not in _MESSAGE_TYPES or not 0 <= flags <= 0xF:
+        raise CodecError(f"bad message type/flags: {msg_type}/{flags}")
+    n = len(payload)
+    b1, b2 = (msg_type << 4) | flags, (serialization << 4) | compression
+    if flags & FLAG_POS_SEQ:
+        if sequence is None:
+            raise CodecError("flags require a sequence")
+        _HDR_SEQ_LEN.pack_into(buf, 0, _B0, b1, b2, 0, sequence, n)
+        off = 12
+    else:
+        _HDR_LEN.pack_into(buf, 0, _B0, b1, b2, 0, n)
+        off = 8
+    buf[off:off + n] = payload
+    return off + n
+
+
+def encode(msg_type: int, payload, flags: int = FLAG_NONE, serialization: int = SER_NONE,
+           compression: int = COMP_NONE, sequence: int = None) -> bytes:
+    """一次性编码：头和长度一次 pack，再与负载拼成一个 bytes（负载只拷贝一次）"""
+    if msg_type not in _MESSAGE_TYPES or not 0 <= flags <= 0xF:
+        raise CodecError(f"bad message type/flags: {msg_type}/{flags}")
+    b1, b2 = (msg_type << 4) | flags, (serialization << 4) | compression
+    if flags & FLAG_POS_SEQ:
+        if sequence is None:
+            raise CodecError("flags require a sequence")
+        return _HDR_SEQ_LEN.pack(_B0, b1, b2, 0, sequence, len(payload)) + payload
+    return _HDR_LEN.pack(_B0, b1, b2, 0, len(payload)) + payload
+
+
+class FrameEncoder:
+    """
+    一个发送方一个：所有帧写进同一块缓冲，只在负载变大时扩容。
+    encode() 返回的 memoryview 在下一次 encode() 之前有效——发送必须在此之前完成
+    （websocket-client 的 send 是同步写出的）。
+    不带 sequence 的帧（v2 音频包都是）直接 pack_into，不经 encode_into；
+    音频包除最后一包外长度相同，返回的视图按长度缓存复用。
+    """
+
+    def __init__(self, capacity: int = 16384):
+        self._buf = bytearray(capacity)
+        self._mv = memoryview(self._buf)   # 常驻视图：切片赋值比 bytearray 走得快
+        self._n = -1
+        self._view = None
+
+    def encode(self, msg_type: int, payload, flags: int = FLAG_NONE, serialization: int = SER_NONE,
+               compression: int = COMP_NONE, sequence: int = None) -> memoryview:
+        n = len(payload)
+        if n + 12 > len(self._buf):
+            self._view = None
+            self._mv.release()
+            self._buf = bytearray(n + 12)
+            self._mv = memoryview(self._buf)
+            self._n = -1
+        mv = self._mv
+        if flags & FLAG_POS_SEQ or msg_type not in _MESSAGE_TYPES or not 0 <= flags <= 0xF:
+            n = encode_into(mv, msg_type, payload, flags, serialization, compression, sequence)
+        else:
+            _HDR_LEN.pack_into(mv, 0, _B0, (msg_type << 4) | flags, (serialization << 4) | compression, 0, n)
+            mv[8:8 + n] = payload
+            n += 8
+        if n != self._n:
+            self._n, self._view = n, mv[:n]
+        return self._view
+
+
+def encode_error(code: int, message: str) -> bytes:
+    msg = message.encode("utf-8")
+    return struct.pack(">BBBBII", _B0, MSG_SERVER_ERROR << 4, SER_JSON << 4, 0, code, len(msg)) + msg
+
+
+# 常见形状（4 字节头、不带 sequence 的非错误帧）的头部前 3 字节 -> Frame 的前 5 个字段
+_FAST = {(_B0 << 16) | (((t << 4) | f) << 8) | b2: (t, f, b2 >> 4, b2 & 0xF, None)
+         for t in MESSAGE_TYPES if t != MSG_SERVER_ERROR
+         for f in range(16) if not f & FLAG_POS_SEQ
+         for b2 in range(256)}
+
+
+def decode(msg) -> Frame:
+    if msg.__class__ is bytes and len(msg) >= 8:
+        # websocket-client 收到的就是 bytes：一次 unpack + 一次查表，不建 memoryview
+        head, size = _HEAD_LEN.unpack_from(msg)
+        fields = _FAST.get(head >> 8)
+        if fields is not None:
+            if 8 + size > len(msg):
+                raise CodecError(f"truncated payload: want {size} B, have {len(msg) - 8} B")
+            return _new(Frame, fields + (msg[8:8 + size], None))
+    mv = memoryview(msg)
+    if mv.itemsize != 1:
+        mv = mv.cast("B")
+    total = len(mv)
+    if total < HEADER_SIZE:
+        raise CodecError(f"frame too short: {total} B")
+    b0, b1, b2, _ = _HDR.unpack_from(mv)
+    if b0 >> 4 != VERSION:
+        raise CodecError(f"unsupported version {b0 >> 4}")
+    off = (b0 & 0xF) * 4
+    if off < HEADER_SIZE or off > total:
+        raise CodecError(f"bad header size {off}")
+    msg_type, flags = b1 >> 4, b1 & 0xF
+    ser, comp = b2 >> 4, b2 & 0xF
+    if msg_type not in _MESSAGE_TYPES:
+        raise CodecError(f"unknown message type {msg_type}")
+
+    if msg_type == MSG_SERVER_ERROR:
+        if total < off + 8:
+            raise CodecError("truncated error frame")
+        code, size = struct.unpack_from(">II", mv, off)
+        off += 8
+        if off + size > total:
+            raise CodecError("truncated error message")
+        return Frame(msg_type, flags, ser, comp, None, mv[off:off + size], code)
+
+    seq = None
+    if flags & FLAG_POS_SEQ:
+        if total < off + 4:
+            raise CodecError("truncated sequence")
+        seq = _I32.unpack_from(mv, off)[0]
+        off += 4
+    if msg_type == MSG_SERVER_ACK and off == total:
+        return Frame(msg_type, flags, ser, comp, seq, mv[off:off])
+    if total < off + 4:
+        raise CodecError("truncated payload size")
+    size = _U32.unpack_from(mv, off)[0]
+    off += 4
+    if off + size > total:
+        raise CodecError(f"truncated payload: want {size} B, have {total - off} B")
+    return Frame(msg_type, flags, ser, comp, seq, mv[off:off + size])
+
+
+def server_sequence(frame: Frame, resp: dict) -> int:
+    """
+    服务端结果的 sequence：头部带了就用头部的，否则看 JSON 里的 sequence（v2 接口）。
+    负数表示最终结果；头部只有 FLAG_LAST 没有数值时返回 -1。
+    """
+    if frame.sequence is not None:
+        return frame.sequence
+    seq = int(resp.get("sequence", 0))
+    if frame.flags & FLAG_LAST:
+        return -abs(seq) or -1
+    return seq
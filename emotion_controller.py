@@ -2,7 +2,8 @@ import json
 import queue
 import threading
 import re
-import requests
+import http_client
+import message_router
 from typing import List, Tuple
 
 # ---------------- Configuration ----------------
@@ -62,10 +63,8 @@ class EmotionController(threading.Thread):
                 "faces": faces,
                 "acts":  acts
             })
-            try:
-                ws.send(payload)
-            except Exception as e:
-                print("[EmotionController] ws.send failed:", e)
+            # ws 可以是连接本身或 message_router.Route；投递失败由 router 计数
+            message_router.send(ws, payload)
 
     # ------------  INTERNAL  -----------
     def _get_sequence(self, prompt: str) -> Tuple[List[int], List[int]]:
@@ -79,8 +78,8 @@ class EmotionController(threading.Thread):
             "user": self.user_id,
             "response_mode": "blocking",
         }
-        resp = requests.post(self.api_url, headers=self.headers,
-                             json=body, timeout=90)
+        resp = http_client.post("emotion", self.api_url, headers=self.headers,
+                                json=body, timeout=90)
         resp.raise_for_status()
         return resp.json().get("answer", "").strip()
 
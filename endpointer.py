@@ -0,0 +1,124 @@
+# endpointer.py
+# 基于 Silero 概率的端点检测状态机，全部按音频时间计时（与网络到达节奏无关）。
+# 默认值可用环境变量覆盖，单个连接可通过 {"label":"vad_config","endpoint":{...}} 调整。
+
+import logging
+import math
+import os
+from collections import deque
+from typing import Optional
+
+FRAME_MS = 32  # 512 samples @ 16 kHz
+
+logger = logging.getLogger(__name__)
+
+
+def _env(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default)))
+
+
+class Endpointer:
+    """
+    IDLE ──(onset 窗口内 prob≥onset 的帧累计 ≥ min_speech_ms)──▶ SPEECH   返回 "start"
+    SPEECH ──(prob<offset 的连续静音 ≥ 当前 trailing 超时)──▶ IDLE        返回 "end"
+
+    - onset / offset 双阈值迟滞：进入语音要求高概率，维持语音只要求不低于 offset；
+    - 静音按帧时长累计，prob 回到 offset 以上即清零；
+    - trailing 超时自适应：已说话 ≤ adapt_start_ms 时为 max_silence_ms，
+      ≥ adapt_end_ms 时缩到 min_silence_ms，中间线性插值——长句说完不必再等满 1.5 秒。
+    """
+
+    PARAMS = ("onset", "offset", "onset_window_ms", "min_speech_ms",
+              "max_silence_ms", "min_silence_ms", "adapt_start_ms", "adapt_end_ms")
+
+    def __init__(self,
+                 onset: float = _env("EP_ONSET", 0.6),
+                 offset: float = _env("EP_OFFSET", 0.35),
+                 onset_window_ms: float = _env("EP_ONSET_WINDOW_MS", 320),
+                 min_speech_ms: float = _env("EP_MIN_SPEECH_MS", 192),
+                 max_silence_ms: float = _env("EP_MAX_SILENCE_MS", 1500),
+                 min_silence_ms: float = _env("EP_MIN_SILENCE_MS", 600),
+                 adapt_start_ms: float = _env("EP_ADAPT_START_MS", 3000),
+                 adapt_end_ms: float = _env("EP_ADAPT_END_MS", 8000)):
+        self.onset = onset
+        self.offset = offset
+        self.onset_window_ms = onset_window_ms
+        self.min_speech_ms = min_speech_ms
+        self.max_silence_ms = max_silence_ms
+        self.min_silence_ms = min_silence_ms
+        self.adapt_start_ms = adapt_start_ms
+        self.adapt_end_ms = adapt_end_ms
+        self.last_speech_ms = 0.0
+        self.reset()
+
+    def configure(self, **params):
+        """客户端 vad_config 下发的参数：解析不了或越界的记日志跳过；
+        概率截到 [0, 1]，时长须 > 0，onset 不得低于 offset（否则迟滞失效，两者都不改）"""
+        new = {}
+        for k, v in params.items():
+            if k not in self.PARAMS: continue
+            try:
+                f = float(v)
+                if not math.isfinite(f): raise ValueError
+            except (TypeError, ValueError):
+                logger.warning(f"[endpoint] ignore bad {k}={v!r}"); continue
+            if k in ("onset", "offset"):
+                f = min(max(f, 0.0), 1.0)
+            elif f <= 0:
+                logger.warning(f"[endpoint] ignore non-positive {k}={v!r}"); continue
+            new[k] = f
+        onset, offset = new.get("onset", self.onset), new.get("offset", self.offset)
+        if onset < offset:
+            logger.warning(f"[endpoint] ignore onset={onset} < offset={offset}")
+            new.pop("onset", None); new.pop("offset", None)
+        for k, f in new.items():
+            setattr(self, k, f)
+
+    def reset(self):
+        self.speaking = False
+        self.speech_ms = 0.0      # 本句累计语音时长
+        self.silence_ms = 0.0     # 当前连续静音时长
+        self._window = deque()    # onset 窗口内每帧 (dur, voiced)
+        self._window_ms = 0.0
+        self._window_voiced = 0.0
+
+    def trailing_timeout(self) -> float:
+        """当前 utterance 下判定结束所需的静音时长 (ms)"""
+        if self.speech_ms <= self.adapt_start_ms:
+            return self.max_silence_ms
+        if self.speech_ms >= self.adapt_end_ms:
+            return self.min_silence_ms
+        frac = (self.speech_ms - self.adapt_start_ms) / (self.adapt_end_ms - self.adapt_start_ms)
+        return self.max_silence_ms - frac * (self.max_silence_ms - self.min_silence_ms)
+
+    def update(self, prob: float, frame_ms: float = FRAME_MS) -> Optional[str]:
+        """喂一帧概率，返回 "start" / "end" / None"""
+        if not self.speaking:
+            voiced = prob >= self.onset
+            self._window.append((frame_ms, voiced))
+            self._window_ms += frame_ms
+            self._window_voiced += frame_ms if voiced else 0.0
+            while self._window_ms > self.onset_window_ms and len(self._window) > 1:
+                dur, v = self._window.popleft()
+                self._window_ms -= dur
+                self._window_voiced -= dur if v else 0.0
+            if self._window_voiced >= self.min_speech_ms:
+                self.speaking = True
+                self.speech_ms = self._window_voiced
+                self.silence_ms = 0.0
+                return "start"
+            return None
+
+        if prob >= self.offset:
+            self.speech_ms += frame_ms
+            self.silence_ms = 0.0
+            return None
+        self.silence_ms += frame_ms
+        if self.silence_ms >= self.trailing_timeout():
+            self.last_speech_ms = self.speech_ms
+            self.reset()
+            return "end"
+        return None
+
+    def stats(self) -> dict:
+        return {k: getattr(self, k) for k in self.PARAMS}
@@ -0,0 +1,37 @@
+# event_bus.py
+# 进程内事件总线：识别 / 对话各阶段把事件发布到主题上，其他模块订阅后提前开工，不必等上一阶段跑完。
+# 回调在发布方的 greenlet / 线程里同步执行，必须很快返回，耗时工作请自己丢进线程池。
+#   asr_partial  session, text   识别的中间结果：切段的长句为各段按序拼接的整句文本，变化时发一次
+#   speech_end   session, text   端点检测判定说完，text 是当时的整句中间结果（可能为空）
+#   reply_sentence  session, index, text   流式回复切出的第 index 句（session 同上，即发起这句话的连接）
+
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger("event_bus")
+
+_subs = defaultdict(list)
+_lock = threading.Lock()
+
+
+def subscribe(topic: str, fn):
+    with _lock:
+        if fn not in _subs[topic]:
+            _subs[topic].append(fn)
+
+
+def unsubscribe(topic: str, fn):
+    with _lock:
+        if fn in _subs[topic]:
+            _subs[topic].remove(fn)
+
+
+def publish(topic: str, **event):
+    with _lock:
+        subs = list(_subs.get(topic, ()))
+    for fn in subs:
+        try:
+            fn(**event)
+        except Exception as e:
+            logger.error("subscriber %s on %s failed: %s", getattr(fn, "__name__", fn), topic, e, exc_info=True)
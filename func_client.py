@@ -1,7 +1,7 @@
 # func_client.py
 import os
 import json
-import requests
+import http_client
 from sseclient import SSEClient
 from llm_client import chat_with_dify  # blocking 模式调用 Dify
 import time
@@ -49,45 +49,42 @@ def call_dify(query: str, user_id: str = "default-user"):
         "function_call":  "auto"
     }
 
-    resp = requests.post(
-        DIFY_URL, headers=headers, json=body,
-        stream=True, timeout=60
-    )
-    resp.raise_for_status()
+    with http_client.stream("func_call", DIFY_URL, headers=headers, json=body, timeout=60) as resp:
+        resp.raise_for_status()
 
-    last_recv = time.time()        # 最近一次真正收到流数据的时间
+        last_recv = time.time()        # 最近一次真正收到流数据的时间
 
-    for raw in resp.iter_lines(decode_unicode=True):
-        # ---- 0) 超时：1 s 内一个字节都没到 ----
-        if time.time() - last_recv > timeout_sec:
-            print(f"⚠️  {timeout_sec}s 未收到任何流数据 → 认为未触发函数")
-            break
+        for raw in resp.iter_lines(decode_unicode=True):
+            # ---- 0) 超时：1 s 内一个字节都没到 ----
+            if time.time() - last_recv > timeout_sec:
+                print(f"⚠️  {timeout_sec}s 未收到任何流数据 → 认为未触发函数")
+                break
 
-        if not raw:                # keep-alive 空行
-            continue
+            if not raw:                # keep-alive 空行
+                continue
 
-        last_recv = time.time()    # 收到数据，刷新计时
+            last_recv = time.time()    # 收到数据，刷新计时
 
-        if not raw.startswith("data:"):
-            continue
+            if not raw.startswith("data:"):
+                continue
 
-        payload = json.loads(raw[len("data:"):])
+            payload = json.loads(raw[len("data:"):])
 
-        # ---- 1) 捕获 function_call ----
-        if payload.get("event") == "agent_thought" and payload.get("tool_input"):
-            tool_input = json.loads(payload["tool_input"])
-            name, args = next(iter(tool_input.items()))
-            print("✅ 捕捉到函数调用")
-            return {
-                "label":      "function",
-                "name":       name,
-                "arguments":  args
-            }
+            # ---- 1) 捕获 function_call ----
+            if payload.get("event") == "agent_thought" and payload.get("tool_input"):
+                tool_input = json.loads(payload["tool_input"])
+                name, args = next(iter(tool_input.items()))
+                print("✅ 捕捉到函数调用")
+                return {
+                    "label":      "function",
+                    "name":       name,
+                    "arguments":  args
+                }
 
-        # ---- 2) 流自然结束也没捕获 ----
-        if payload.get("event") == "message_end":
-            print("ℹ️ 流结束未捕获函数")
-            break
+            # ---- 2) 流自然结束也没捕获 ----
+            if payload.get("event") == "message_end":
+                print("ℹ️ 流结束未捕获函数")
+                break
 
     # 走到这里代表：超时 / message_end / 其它情况均未触发函数
     return {"label": "none"}
@@ -0,0 +1,175 @@
+# http_client.py
+# 所有对外 HTTP API（Dify、火山方舟）共用的客户端：一个 requests.Session，按 host 复用 keep-alive 连接，
+# 每轮对话的 3~4 次调用不再各自重新握手 TCP + TLS。
+#   - 统一超时：(连接, 读取)，调用方可按接口覆盖读取超时；
+#   - 重试：只在请求基本可以确定没被处理时重试（连不上 / 连接超时 / 连接被对端断开——多是池里的空闲连接
+#     已被服务器关掉 / 429 / 502 / 503 / 504），指数退避 + 全抖动；
+#     读超时不重试——LLM 请求可能已经在跑，重发只会多扣一次费用；
+#   - 并发上限：每个 host 同时在途的请求数，超出的排队（与连接池大小一致，避免临时建连）；
+#   - 每个 endpoint（逻辑名，如 dify_chat / emotion）一张延迟直方图，见 stats()。
+# 配置在 az_agent.yaml 的 http 段。
+
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config_loader import config
+
+logger = logging.getLogger("http_client")
+
+_CFG = config.get("http") or {}
+CONNECT_TIMEOUT = float(_CFG.get("connect_timeout", 3))
+READ_TIMEOUT = float(_CFG.get("read_timeout", 30))
+RETRIES = int(_CFG.get("retries", 2))
+BACKOFF_BASE_MS = float(_CFG.get("backoff_base_ms", 200))
+BACKOFF_MAX_MS = float(_CFG.get("backoff_max_ms", 2000))
+MAX_PER_HOST = int(_CFG.get("max_per_host", 8))
+
+RETRY_STATUS = frozenset((429, 502, 503, 504))
+BUCKETS_MS = (50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, float("inf"))
+
+
+class LatencyHistogram:
+    """固定桶的延迟直方图；分位数按桶上界估计。多个请求线程并发写，计数都在锁内改、锁内读"""
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS_MS)
+        self.requests = self.errors = self.retries = 0
+        self.total_ms = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, ms: float, ok: bool):
+        with self._lock:
+            self.requests += 1
+            self.errors += not ok
+            self.total_ms += ms
+            for i, bound in enumerate(BUCKETS_MS):
+                if ms <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def retried(self):
+        with self._lock:
+            self.retries += 1
+
+    def quantile(self, q: float) -> float:
+        need, seen = q * sum(self.counts), 0
+        for bound, n in zip(BUCKETS_MS, self.counts):
+            seen += n
+            if n and seen >= need:
+                return bound
+        return 0.0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"requests": self.requests, "errors": self.errors, "retries": self.retries,
+                    "avg_ms": round(self.total_ms / self.requests, 1) if self.requests else 0.0,
+                    "p50_ms": self.quantile(0.5), "p95_ms": self.quantile(0.95),
+                    "buckets": {("+inf" if b == float("inf") else f"le_{b}"): n
+                                for b, n in zip(BUCKETS_MS, self.counts)}}
+
+
+class HTTPClient:
+    def __init__(self, max_per_host: int = MAX_PER_HOST):
+        self.max_per_host = max_per_host
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=max_per_host, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._slots = {}
+        self._hist = {}
+        self._lock = threading.Lock()
+
+    def _slot(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._slots:
+                self._slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._slots[host]
+
+    def _histogram(self, endpoint: str) -> LatencyHistogram:
+        with self._lock:
+            return self._hist.setdefault(endpoint, LatencyHistogram())
+
+    def _send(self, endpoint: str, method: str, url: str, timeout, retries, **kwargs) -> requests.Response:
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT if timeout is None else timeout)
+        retries = RETRIES if retries is None else retries
+        hist = self._histogram(endpoint)
+        for attempt in range(retries + 1):
+            last = attempt == retries
+            try:
+                resp = self.session.request(method, url, timeout=timeout, **kwargs)
+            except requests.ConnectionError as e:
+                # 含 ConnectTimeout；ReadTimeout 不是 ConnectionError，直接抛出
+                if last:
+                    raise
+                logger.warning("[%s] %s, retry %d/%d", endpoint, e.__class__.__name__, attempt + 1, retries)
+            else:
+                if resp.status_code not in RETRY_STATUS or last:
+                    return resp
+                logger.warning("[%s] HTTP %d, retry %d/%d", endpoint, resp.status_code, attempt + 1, retries)
+                resp.close()
+            hist.retried()
+            time.sleep(random.uniform(0, min(BACKOFF_MAX_MS, BACKOFF_BASE_MS * 2 ** attempt)) / 1000)
+
+    def request(self, endpoint: str, method: str, url: str, timeout: float = None, retries: int = None,
+                **kwargs) -> requests.Response:
+        """
+        发一个非流式请求并读完响应体，返回 Response（不替调用方 raise_for_status）。
+        timeout 是读取超时（秒），连接超时统一用 CONNECT_TIMEOUT。
+        """
+        hist, t0, ok = self._histogram(endpoint), time.perf_counter(), False
+        with self._slot(url):
+            try:
+                resp = self._send(endpoint, method, url, timeout, retries, **kwargs)
+                ok = resp.status_code < 400
+                return resp
+            finally:
+                hist.record((time.perf_counter() - t0) * 1000, ok)
+
+    def post(self, endpoint: str, url: str, **kwargs) -> requests.Response:
+        return self.request(endpoint, "POST", url, **kwargs)
+
+    @contextmanager
+    def stream(self, endpoint: str, url: str, method: str = "POST", timeout: float = None, retries: int = None,
+               **kwargs):
+        """
+        流式请求（SSE 等）：with 块内持有该 host 的并发名额，退出时关闭响应、把连接还回池；
+        延迟按整个流（含读完）计。
+        """
+        hist, t0, ok = self._histogram(endpoint), time.perf_counter(), False
+        with self._slot(url):
+            try:
+                resp = self._send(endpoint, method, url, timeout, retries, stream=True, **kwargs)
+                try:
+                    yield resp
+                    ok = resp.status_code < 400
+                finally:
+                    resp.close()
+            finally:
+                hist.record((time.perf_counter() - t0) * 1000, ok)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {name: h.snapshot() for name, h in self._hist.items()}
+
+
+CLIENT = HTTPClient()
+
+
+def post(endpoint: str, url: str, **kwargs) -> requests.Response:
+    return CLIENT.post(endpoint, url, **kwargs)
+
+
+def stream(endpoint: str, url: str, **kwargs):
+    return CLIENT.stream(endpoint, url, **kwargs)
+
+
+def stats() -> dict:
+    return CLIENT.stats()
@@ -0,0 +1,188 @@
+# intent_classifier.py
+# 桌宠工具的本地意图预分类：关键词/拼音规则 + 字符 n-gram 朴素贝叶斯，纯 CPU、每句亚毫秒。
+# 只回答一个问题：这句话是不是“肯定不用调工具”。这类句子（闲聊占绝大多数）跳过 CAMEL 的 LLM 往返；
+# 命中规则或模型拿不准的句子照旧交给 CAMEL，由它选工具、填参数——宁可多问一次 LLM，也不漏掉指令。
+# 训练数据：工具函数 docstring 里的触发说法 + intent_phrases.tsv（标签<TAB>句子）。
+# 拼音特征用 pypinyin（可选依赖），未安装时只用汉字特征；装上后 ASR 同音错字（如“博放”）也能命中规则。
+#   INTENT_FASTPATH        1 开启（默认），0 每句都走 CAMEL
+#   INTENT_SKIP_THRESHOLD  判为“无工具”所需的后验概率（默认 0.9）
+
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    from pypinyin import lazy_pinyin
+except ImportError:  # 可选依赖
+    lazy_pinyin = None
+
+logger = logging.getLogger("intent_classifier")
+
+INTENT_FASTPATH = os.getenv("INTENT_FASTPATH", "1") == "1"
+INTENT_SKIP_THRESHOLD = float(os.getenv("INTENT_SKIP_THRESHOLD", "0.9"))
+PHRASES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_phrases.tsv")
+PINYIN_AVAILABLE = lazy_pinyin is not None
+
+NONE = "none"
+
+# 每个工具的高召回关键词：docstring 里提取的说法之外，人工补充常见口语
+KEYWORDS: Dict[str, List[str]] = {
+    "play_music": ["播放", "放首", "放一首", "来首", "来一首", "听歌", "放歌", "放点", "歌单", "专辑", "音乐",
+                   "唱首", "我要听", "我想听"],
+    "screenshot": ["截屏", "截图", "截个", "截一下", "拍照", "拍张", "拍个", "拍一下", "自拍", "摄像头", "相机",
+                   "睁开眼", "睁眼", "看看我", "看到我", "看看屏幕", "看下", "看一下", "屏幕上", "你看看"],
+    "recite_poem": ["背诗", "背首", "背一首", "吟诗", "吟一首", "念首", "念一首", "首诗", "朗诵", "宋词", "绝句"],
+}
+
+_PUNCT = re.compile(r"[\s\W_]+", re.UNICODE)
+
+
+def normalize(text: str) -> str:
+    return _PUNCT.sub("", text or "").lower()
+
+
+def pinyin(text: str) -> List[str]:
+    return lazy_pinyin(text) if lazy_pinyin is not None else []
+
+
+def docstring_phrases(doc: str) -> List[str]:
+    """从工具 docstring 里抽触发说法：引号里的短语，以及“说/让你 …… 时”之间用 / 、， 分隔的列表"""
+    doc = doc or ""
+    raw = re.findall(r"“([^”]+)”", doc)
+    for span in re.findall(r"(?:说|让你)([^“”\n]+?)时", doc):
+        raw.extend(re.split(r"[/、，,]", span))
+    phrases = []
+    for p in raw:
+        for part in p.split("+"):   # “播放+歌曲名”：占位的“……名”丢掉
+            part = normalize(part)
+            if len(part) >= 2 and not part.endswith("名") and part not in phrases:
+                phrases.append(part)
+    return phrases
+
+
+def load_phrases(path: str = PHRASES_PATH) -> List[Tuple[str, str]]:
+    samples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line or line.startswith("#") or "\t" not in line:
+                continue
+            label, text = line.split("\t", 1)
+            samples.append((label.strip(), text.strip()))
+    return samples
+
+
+def _features(text: str) -> List[str]:
+    s = f"^{normalize(text)}$"
+    feats = [s[i:i + n] for n in (1, 2, 3) for i in range(len(s) - n + 1)]
+    py = pinyin(normalize(text))
+    feats += ["py:" + p for p in py]
+    feats += ["py:" + a + "_" + b for a, b in zip(py, py[1:])]
+    return feats
+
+
+class IntentClassifier:
+    """
+    fit(samples) 用 (标签, 句子) 训练；decide(text) 返回 (skip, label, p_none, reason)：
+    - reason="rule"  命中某个工具的关键词（汉字或拼音），交给 CAMEL；
+    - reason="model" 朴素贝叶斯的 P(none) ≥ skip_threshold 时 skip=True，否则交给 CAMEL。
+    """
+
+    def __init__(self, keywords: Dict[str, List[str]] = None, skip_threshold: float = INTENT_SKIP_THRESHOLD,
+                 alpha: float = 1.0):
+        self.keywords = {k: list(v) for k, v in (keywords if keywords is not None else KEYWORDS).items()}
+        self.skip_threshold = skip_threshold
+        self.alpha = alpha
+        self._py_keywords: Dict[str, List[str]] = {}
+        self._counts: Dict[str, Counter] = {}
+        self._totals: Dict[str, int] = {}
+        self._priors: Dict[str, float] = {}
+        self._vocab = set()
+        self._lock = threading.Lock()
+        self.decisions = self.skipped = self.rule_hits = 0
+
+    @classmethod
+    def from_tools(cls, tools: Dict[str, object], phrases_path: Optional[str] = PHRASES_PATH, **kwargs):
+        """用工具函数（取 __doc__）和标注语料建分类器；语料文件缺失时只用 docstring"""
+        docs = {name: getattr(fn, "__doc__", "") or "" for name, fn in tools.items()}
+        samples = load_phrases(phrases_path) if phrases_path and os.path.exists(phrases_path) else []
+        return cls(**kwargs).fit(samples, docs)
+
+    def fit(self, samples: Iterable[Tuple[str, str]], docs: Dict[str, str] = None) -> "IntentClassifier":
+        samples = list(samples)
+        for name, doc in (docs or {}).items():
+            phrases = docstring_phrases(doc)
+            kws = self.keywords.setdefault(name, [])
+            kws.extend(p for p in phrases if p not in kws)
+            samples.extend((name, p) for p in phrases)
+        self._py_keywords = {name: [" ".join(pinyin(k)) for k in kws if len(k) >= 2] if PINYIN_AVAILABLE else []
+                             for name, kws in self.keywords.items()}
+        counts, docs_per_label = defaultdict(Counter), Counter()
+        for label, text in samples:
+            counts[label].update(_features(text))
+            docs_per_label[label] += 1
+        n = sum(docs_per_label.values()) or 1
+        self._counts = dict(counts)
+        self._totals = {k: sum(c.values()) for k, c in counts.items()}
+        self._priors = {k: math.log(v / n) for k, v in docs_per_label.items()}
+        self._vocab = {f for c in counts.values() for f in c}
+        return self
+
+    def rule(self, text: str) -> Optional[str]:
+        """命中关键词的工具名；没命中返回 None"""
+        s = normalize(text)
+        for name, kws in self.keywords.items():
+            if any(k in s for k in kws):
+                return name
+        if PINYIN_AVAILABLE:
+            py = " ".join(pinyin(s))
+            for name, kws in self._py_keywords.items():
+                if any(k and k in py for k in kws):
+                    return name
+        return None
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """
+        朴素贝叶斯：返回 (最可能的标签, P(none))。
+        训练里没出现过的 n-gram 不参与打分——否则平滑会让样本少的工具类在生词上占便宜，闲聊句子反而判不出 none。
+        """
+        feats = [f for f in _features(text) if f in self._vocab]
+        scores = {}
+        for label, counts in self._counts.items():
+            denom = math.log(self._totals[label] + self.alpha * len(self._vocab))
+            scores[label] = self._priors[label] + sum(math.log(counts.get(f, 0) + self.alpha) - denom for f in feats)
+        if not scores:
+            return NONE, 0.0
+        top = max(scores.values())
+        z = sum(math.exp(v - top) for v in scores.values())
+        p_none = math.exp(scores[NONE] - top) / z if NONE in scores else 0.0
+        return max(scores, key=scores.get), p_none
+
+    def decide(self, text: str, record: bool = True) -> Tuple[bool, str, float, str]:
+        """record=False 时不计入 stats()（如投机预判，避免同一句算两次）"""
+        if not normalize(text):
+            return self._count(True, False, record), NONE, 1.0, "empty"
+        name = self.rule(text)
+        if name is not None:
+            return self._count(False, True, record), name, 0.0, "rule"
+        label, p_none = self.predict(text)
+        return self._count(p_none >= self.skip_threshold, False, record), label, p_none, "model"
+
+    def _count(self, skip: bool, rule_hit: bool, record: bool = True) -> bool:
+        if not record:
+            return skip
+        with self._lock:
+            self.decisions += 1
+            self.skipped += skip
+            self.rule_hits += rule_hit
+        return skip
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"decisions": self.decisions, "skipped": self.skipped, "rule_hits": self.rule_hits,
+                    "skip_rate": round(self.skipped / self.decisions, 3) if self.decisions else 0.0,
+                    "pinyin": PINYIN_AVAILABLE}
@@ -1,11 +1,17 @@
 import os
+import re
 import json
+import time
 import logging
-import requests
-from typing import Tuple, Generator
+import threading
+import http_client
+import message_router
+import memory_cache
+from typing import Callable, List, Optional, Tuple, Generator
+import event_bus
+from config_loader import config
 from memorymanager import append_memory
 from emotion_controller import EmotionController
-from websocket import create_connection
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +21,9 @@ logger = logging.getLogger(__name__)
 LLM_DIFY_API_KEY = os.getenv("DIFY_API_KEY", "app-5jjjKuPVe3fV675MGtzGR6rD")
 DIFY_API_URL = os.getenv("DIFY_API_URL", "https://api.dify.ai/v1/chat-messages")
 DEFAULT_TIMEOUT = float(os.getenv("DIFY_TIMEOUT", "10"))  # seconds
+STREAM_TIMEOUT = float(os.getenv("DIFY_STREAM_TIMEOUT", str((config.get("llm_client") or {}).get("stream_timeout", 40))))
+# 1：对话回复走 chat_stream_dify（SSE 流式，边生成边推 chat_delta）；0：chat_with_dify 阻塞式
+DIFY_STREAMING = os.getenv("DIFY_STREAMING", "1") == "1"
 
 # Initialize emotion controller
 em_ctrl = EmotionController()
@@ -23,26 +32,19 @@ em_ctrl = EmotionController()
 
 def chat_with_dify(query: str, user_id: str = "default-user",ws=None) -> Tuple[str, str]:
     """Send a single blocking chat request to Dify, integrating memory and prompt.
+    The reply and its emotion payload go to `ws` (a connection or a
+    `message_router.Route`); without one they are counted as undeliverable.
     Returns `(answer, conversation_id)`.
     Raises `requests.RequestException` on network error.
     """
     # Prepare memory directory
-    ws: any = None,
     mem_dir = os.path.join(os.getcwd(), "voicememory")
     os.makedirs(mem_dir, exist_ok=True)
-    # Read episodic and short-term memory
-    epi_path = os.path.join(mem_dir, "Episodicmemory.txt")
-    short_path = os.path.join(mem_dir, "voicememory.txt")
-    epi = open(epi_path, "r", encoding="utf-8").read() if os.path.exists(epi_path) else ""
-    short = open(short_path, "r", encoding="utf-8").read() if os.path.exists(short_path) else ""
+    # Episodic and short-term memory come from the in-memory snapshot (taken before this query is appended)
+    memory = memory_cache.snapshot(mem_dir)
     append_memory(mem_dir, "主人说", query)
     # Build prompt
-    prompt = (
-        f"===情景记忆===\n{epi}\n$@$"
-        f"===短期对话===\n{short}\n$@$"
-        f"===用户说===\n{query}\n"
-        "请以阿紫口吻回复："
-    )
+    prompt = memory.chat_prefix + f"===用户说===\n{query}\n请以阿紫口吻回复："
 
     # Prepare request
     headers = {
@@ -58,7 +60,8 @@ def chat_with_dify(query: str, user_id: str = "default-user",ws=None) -> Tuple[s
 
     # Send request
     try:
-        resp = requests.post(
+        resp = http_client.post(
+            "dify_chat",
             DIFY_API_URL,
             headers=headers,
             json=body,
@@ -77,18 +80,200 @@ def chat_with_dify(query: str, user_id: str = "default-user",ws=None) -> Tuple[s
 
     # Append to memory
     append_memory(mem_dir, "我（阿紫）说", answer)
-    # Emotion feedback
-    try:
-        ws = create_connection(os.getenv("WS_URL", "ws://localhost:8000/ws"))
+    # Reply + emotion feedback straight to the originating connection
+    message_router.send(ws, {"label": "chat", "reply": answer})
+    if ws is not None:
         em_ctrl.submit(prompt=answer, ws=ws)
-        ws.send(json.dumps({"label": "chat", "reply": answer}, ensure_ascii=False))
-        ws.close()
-    except Exception:
-        logger.debug("WebSocket send failed, skipping emotion feedback.")
 
     return answer, conv_id
 
 
+# ---------------------------------------------------------------------------
+# Streaming
+# ---------------------------------------------------------------------------
+_SENTENCE_END = re.compile(r"[。！？!?；;…\n]+[”」』）)]*")
+SENTENCE_MAX_CHARS = int(os.getenv("SENTENCE_MAX_CHARS", "60"))
+
+
+class SentenceSplitter:
+    """把流式增量拼成整句：遇到句末标点切句；没有句末标点的长句超过 max_chars 时在最后一个逗号处切"""
+
+    def __init__(self, max_chars: int = SENTENCE_MAX_CHARS):
+        self.max_chars = max_chars
+        self._buf = ""
+
+    def feed(self, delta: str) -> List[str]:
+        self._buf += delta
+        out = []
+        while True:
+            m = _SENTENCE_END.search(self._buf)
+            if m:
+                cut = m.end()
+            elif len(self._buf) > self.max_chars:
+                cut = max(self._buf.rfind("，"), self._buf.rfind(",")) + 1 or len(self._buf)
+            else:
+                break
+            sentence, self._buf = self._buf[:cut].strip(), self._buf[cut:]
+            if sentence:
+                out.append(sentence)
+        return out
+
+    def flush(self) -> List[str]:
+        rest, self._buf = self._buf.strip(), ""
+        return [rest] if rest else []
+
+
+class StreamStats:
+    """流式回复的延迟统计：TTFT（请求发出到第一段文本）与整段耗时，保留最近 window 次"""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._ttft: List[float] = []
+        self._total: List[float] = []
+        self._lock = threading.Lock()
+        self.requests = self.errors = 0
+
+    def record(self, ttft_ms: Optional[float], total_ms: float, ok: bool = True):
+        with self._lock:
+            self.requests += 1
+            self.errors += not ok
+            if ttft_ms is not None:
+                self._ttft = (self._ttft + [ttft_ms])[-self.window:]
+            self._total = (self._total + [total_ms])[-self.window:]
+
+    @staticmethod
+    def _pct(values: List[float], q: float) -> float:
+        if not values:
+            return 0.0
+        v = sorted(values)
+        return round(v[min(len(v) - 1, int(q * len(v)))], 1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"requests": self.requests, "errors": self.errors,
+                    "ttft_p50_ms": self._pct(self._ttft, 0.5), "ttft_p95_ms": self._pct(self._ttft, 0.95),
+                    "total_p50_ms": self._pct(self._total, 0.5), "total_p95_ms": self._pct(self._total, 0.95)}
+
+
+STREAM_STATS = StreamStats()
+
+
+def stream_stats() -> dict:
+    return STREAM_STATS.snapshot()
+
+
+def _iter_sse(resp) -> Generator[dict, None, None]:
+    """
+    逐个产出 Dify SSE 的 data JSON（空行 / 注释 / 非 data 行跳过）。
+    chunk_size=None：Dify 的 SSE 是 chunked 传输，每到一个 chunk 就处理，不攒满 512 字节才出行；SSE 不带 charset 时 requests 会按 latin-1 解码，固定 UTF-8。
+    """
+    resp.encoding = "utf-8"
+    for raw in resp.iter_lines(chunk_size=None, decode_unicode=True):
+        if not raw or not raw.startswith("data:"):
+            continue
+        try:
+            yield json.loads(raw[len("data:"):])
+        except ValueError:
+            logger.warning(f"[Dify stream] bad event: {raw[:80]!r}")
+
+
+def chat_stream_dify(query: str, user_id: str = "default-user", ws=None,
+                     on_sentence: Callable[[int, str], None] = None, session: str = None) -> Tuple[str, str]:
+    """Streaming counterpart of `chat_with_dify` (``response_mode: "streaming"``).
+    Each text delta is pushed to `ws` as ``{"label":"chat_delta","text":...,"seq":n}``;
+    complete sentences are sent as ``{"label":"chat_sentence","index":i,"text":...}``
+    and also go to `on_sentence(index, text)` and the event bus topic ``reply_sentence``,
+    tagged with `session` (the connection's session id, as on ``asr_partial`` / ``speech_end``).
+    When the stream ends the full answer is written to memory, sent as
+    ``{"label":"chat","reply":...,"streamed":true}`` and handed to the emotion controller.
+    If the stream fails after some deltas were sent, the remaining sentence is flushed,
+    the partial answer is written to memory and closed with a final ``chat`` carrying
+    ``"streamed": true`` and ``"error"``; if nothing was sent yet the client gets
+    ``{"label":"error",...}``. Either way the exception is re-raised.
+    Returns `(answer, conversation_id)`; raises on network / Dify errors.
+    """
+    mem_dir = os.path.join(os.getcwd(), "voicememory")
+    os.makedirs(mem_dir, exist_ok=True)
+    memory = memory_cache.snapshot(mem_dir)
+    append_memory(mem_dir, "主人说", query)
+    prompt = memory.chat_prefix + f"===用户说===\n{query}\n请以阿紫口吻回复："
+    headers = {
+        "Authorization": f"Bearer {LLM_DIFY_API_KEY}",
+        "Content-Type": "application/json",
+    }
+    body = {
+        "query": query,
+        "inputs": {"prompt": prompt},
+        "user": user_id,
+        "response_mode": "streaming",
+    }
+
+    def emit(payload: dict):
+        message_router.send(ws, payload)
+
+    def sentence(text: str):
+        idx = len(sentences)
+        sentences.append(text)
+        emit({"label": "chat_sentence", "index": idx, "text": text})
+        event_bus.publish("reply_sentence", session=session, index=idx, text=text)
+        if on_sentence is not None:
+            on_sentence(idx, text)
+
+    t0 = time.perf_counter()
+    ttft_ms, parts, sentences, conv_id = None, [], [], ""
+    splitter = SentenceSplitter()
+    try:
+        with http_client.stream("dify_chat_stream", DIFY_API_URL, headers=headers, json=body,
+                                timeout=STREAM_TIMEOUT) as resp:
+            resp.raise_for_status()
+            for ev in _iter_sse(resp):
+                kind = ev.get("event")
+                if kind in ("message", "agent_message"):
+                    delta = ev.get("answer", "")
+                    conv_id = ev.get("conversation_id", conv_id)
+                    if not delta:
+                        continue
+                    if ttft_ms is None:
+                        ttft_ms = (time.perf_counter() - t0) * 1000
+                        logger.info(f"[Dify stream] first text after {ttft_ms:.0f}ms")
+                    emit({"label": "chat_delta", "text": delta, "seq": len(parts)})
+                    parts.append(delta)
+                    for s in splitter.feed(delta):
+                        sentence(s)
+                elif kind == "message_end":
+                    conv_id = ev.get("conversation_id", conv_id)
+                    break
+                elif kind == "error":
+                    raise RuntimeError(f"Dify stream error {ev.get('code')}: {ev.get('message')}")
+    except Exception as e:
+        STREAM_STATS.record(ttft_ms, (time.perf_counter() - t0) * 1000, ok=False)
+        logger.error("[Dify stream] failed", exc_info=True)
+        if parts:
+            # 已推过 chat_delta：补完最后一句、记下半截回复并发结束标记，前端不会停在半句上
+            for s in splitter.flush():
+                sentence(s)
+            answer = "".join(parts)
+            append_memory(mem_dir, "我（阿紫）说", answer)
+            emit({"label": "chat", "reply": answer, "streamed": True, "error": str(e)})
+        else:
+            emit({"label": "error", "error": str(e)})
+        raise
+    for s in splitter.flush():
+        sentence(s)
+
+    answer = "".join(parts)
+    total_ms = (time.perf_counter() - t0) * 1000
+    STREAM_STATS.record(ttft_ms, total_ms)
+    logger.info(f"[Dify stream] ← answer={answer!r} | conv_id={conv_id} | "
+                f"ttft={ttft_ms or 0:.0f}ms total={total_ms:.0f}ms sentences={len(sentences)}")
+
+    append_memory(mem_dir, "我（阿紫）说", answer)
+    emit({"label": "chat", "reply": answer, "streamed": True})
+    if ws is not None:
+        em_ctrl.submit(prompt=answer, ws=ws)
+    return answer, conv_id
+
+
 # # 导入 mem0 管理器
 # from mem0_manager import Mem0Manager
 
@@ -0,0 +1,125 @@
+# memory_cache.py
+# 记忆快照缓存：短期记忆、情景记忆、图像记忆常驻内存，拼 prompt 时直接取快照，不再每轮整文件读盘。
+#   - 进程内写入（memorymanager）写完文件后 put() 新内容，版本号 +1，读者下一次取快照即可见；
+#   - 进程外改动（手工编辑、其他进程）靠 mtime / size 发现：最多每 MEMORY_CACHE_STAT_S 秒 stat 一次，
+#     变了才重读；两次 stat 之间取快照完全不碰文件系统。
+#   - 快照不可变，chat_prefix（情景 + 短期记忆的 prompt 片段）按版本只拼一次。
+
+import os
+import threading
+import time
+
+MEMORY_CACHE_STAT_S = float(os.getenv("MEMORY_CACHE_STAT_S", "2"))
+
+# 与 memorymanager 的 MEM_FILE / EPISODIC_FILE、append_vision_memory 的路径一致
+FILES = {
+    "short": "voicememory.txt",
+    "episodic": "Episodicmemory.txt",
+    "vision": os.path.join("visionmemory", "visionmemory.txt"),
+}
+
+
+class MemorySnapshot:
+    """某一版本的记忆内容；version 每次有文件变化就 +1"""
+
+    __slots__ = ("short", "episodic", "vision", "version", "_chat_prefix")
+
+    def __init__(self, short: str, episodic: str, vision: str, version: int):
+        self.short = short
+        self.episodic = episodic
+        self.vision = vision
+        self.version = version
+        self._chat_prefix = None
+
+    @property
+    def chat_prefix(self) -> str:
+        """对话 prompt 的记忆部分，之后只需拼上“用户说”"""
+        if self._chat_prefix is None:
+            self._chat_prefix = (f"===情景记忆===\n{self.episodic}\n$@$"
+                                 f"===短期对话===\n{self.short}\n$@$")
+        return self._chat_prefix
+
+
+class MemoryCache:
+    def __init__(self, mem_dir: str, stat_interval: float = MEMORY_CACHE_STAT_S):
+        self.mem_dir = mem_dir
+        self.stat_interval = stat_interval
+        self._text = dict.fromkeys(FILES, "")
+        self._stamp = dict.fromkeys(FILES)      # (mtime_ns, size)，文件不存在为 None
+        self._version = 0
+        self._snap = None
+        self._checked = float("-inf")
+        self._lock = threading.Lock()
+        self.reloads = self.hits = 0
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.mem_dir, FILES[name])
+
+    def _stat(self, name: str):
+        try:
+            st = os.stat(self._path(name))
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _refresh(self):
+        for name in FILES:
+            stamp = self._stat(name)
+            if stamp == self._stamp[name]:
+                continue
+            try:
+                with open(self._path(name), "r", encoding="utf-8") as f:
+                    text = f.read()
+            except FileNotFoundError:
+                text = ""
+            self._text[name], self._stamp[name] = text, stamp
+            self._version += 1
+            self.reloads += 1
+
+    def snapshot(self) -> MemorySnapshot:
+        with self._lock:
+            now = time.monotonic()
+            if now - self._checked >= self.stat_interval:
+                self._checked = now
+                self._refresh()
+            else:
+                self.hits += 1
+            if self._snap is None or self._snap.version != self._version:
+                self._snap = MemorySnapshot(self._text["short"], self._text["episodic"],
+                                            self._text["vision"], self._version)
+            return self._snap
+
+    def put(self, name: str, text: str):
+        """写者在文件写完（已关闭）后调用：直接换上新内容，并记下文件戳，避免下次 stat 时重读"""
+        with self._lock:
+            self._text[name], self._stamp[name] = text, self._stat(name)
+            self._version += 1
+
+    def invalidate(self, name: str = None):
+        """只知道文件变了、不想自己拼内容时调用（如追加写）：下次取快照时重新 stat 并重读"""
+        with self._lock:
+            for n in ([name] if name else FILES):
+                self._stamp[n] = -1
+            self._checked = float("-inf")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"version": self._version, "reloads": self.reloads, "hits": self.hits,
+                    "bytes": sum(len(t) for t in self._text.values())}
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def cache(mem_dir: str = None) -> MemoryCache:
+    """按记忆目录（绝对路径）取缓存；默认当前目录下的 voicememory"""
+    key = os.path.abspath(mem_dir or os.path.join(os.getcwd(), "voicememory"))
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = MemoryCache(key)
+        return _caches[key]
+
+
+def snapshot(mem_dir: str = None) -> MemorySnapshot:
+    return cache(mem_dir).snapshot()
@@ -1,6 +1,7 @@
 import os
 from datetime import datetime
-import requests
+import http_client
+import memory_cache
 import logging
 from concurrent.futures import ThreadPoolExecutor
 
@@ -41,6 +42,7 @@ def append_memory(mem_dir: str, role: str, text: str):
     # 3. 写回短期记忆
     with open(file_path, "w", encoding="utf-8") as f:
         f.writelines(lines)
+    memory_cache.cache(mem_dir).put("short", "".join(lines))
 
     logger.info(f"✅ 已保存短期记忆（{role}，共 {len(lines)} 条）: {file_path}")
 
@@ -89,6 +91,7 @@ def refine_memory(mem_dir: str):
     # 5. 更新短期记忆文件，删除已发送的 oldest
     with open(file_path, "w", encoding="utf-8") as f:
         f.writelines(remaining)
+    memory_cache.cache(mem_dir).put("short", "".join(remaining))
     logger.info(f"✂️ 已删除最久远的 {SUMMARY_COUNT} 条短期记忆")
 
     oldest_block = "".join(oldest)
@@ -120,6 +123,7 @@ def refine_memory(mem_dir: str):
             # 9. 覆盖保存新的情景记忆
             with open(epi_path, "w", encoding="utf-8") as f:
                 f.write(updated.strip() + "\n")
+            memory_cache.cache(mem_dir).put("episodic", updated.strip() + "\n")
             logger.info(f"🧠 情景记忆已更新并保存: {epi_path}")
     except Exception as e:
         logger.error(f"❌ 情景记忆提炼失败: {e}", exc_info=True)
@@ -147,7 +151,7 @@ def call_dify_summary(prompt: str) -> str:
         "user": "memory_bot"        # 随便一个内部标识
     }
 
-    resp = requests.post(DIFY_CHAT_URL, json=payload, headers=headers, timeout=90)
+    resp = http_client.post("memory_summary", DIFY_CHAT_URL, json=payload, headers=headers, timeout=90)
     if resp.status_code != 200:
         raise RuntimeError(f"Dify Error {resp.status_code}: {resp.text}")
 
@@ -167,6 +171,7 @@ def save_episodic_memory(mem_dir: str, summary: str):
 
     with open(episodic_path, "a", encoding="utf-8") as f:
         f.write(entry)
+    memory_cache.cache(mem_dir).invalidate("episodic")
 
     logger.info(f"🧠 长期情景记忆已保存: {episodic_path}")
 def append_vision_memory(mem_dir: str, description: str, event_time: datetime = None):
@@ -206,6 +211,7 @@ def append_vision_memory(mem_dir: str, description: str, event_time: datetime =
     # 写回 visionmemory
     with open(file_path, "w", encoding="utf-8") as f:
         f.writelines(entries)
+    memory_cache.cache(mem_dir).put("vision", "".join(entries))
 
     logger.info(f"📷 已保存图像记忆，共 {len(entries)} 条: {file_path}")
 # ======================================================== #
@@ -0,0 +1,106 @@
+# message_router.py
+# 进程内下行消息路由：每个 WebSocket 连接按 session id 登记，回复 / 情绪等消息按 session 直接投递到发起请求的连接，
+# 不再为每轮回复另开一条 WebSocket。连接已断开（或从未登记）的消息计入 undeliverable，不静默丢弃。
+#   register(session, ws) / unregister(session, ws)   连接建立 / 关闭时调用
+#   route(session)      返回带 send() 的投递句柄，可直接当 ws 交给 handle_user_text / EmotionController
+#   send(ws, payload)   向 ws（或 Route）发送，ws 为 None 或发送失败时计数
+
+import json
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger("message_router")
+
+_sinks = {}
+_lock = threading.Lock()
+_delivered = 0
+_undeliverable = Counter()   # label -> 次数（没有目的地）
+_failed = Counter()          # label -> 次数（目的地发送抛异常）
+
+
+def register(session: str, ws):
+    with _lock:
+        _sinks[session] = ws
+
+
+def unregister(session: str, ws=None):
+    """ws 给定时只在登记的仍是它时才注销"""
+    with _lock:
+        if ws is None or _sinks.get(session) is ws:
+            _sinks.pop(session, None)
+
+
+def _label(payload) -> str:
+    if isinstance(payload, dict):
+        return str(payload.get("label", "?"))
+    try:
+        return str(json.loads(payload).get("label", "?"))
+    except (ValueError, AttributeError, TypeError):
+        return "?"
+
+
+def _encode(payload):
+    return json.dumps(payload, ensure_ascii=False) if isinstance(payload, dict) else payload
+
+
+def send(ws, payload) -> bool:
+    """payload 为 dict 时按 JSON 编码；返回是否投递成功"""
+    global _delivered
+    if ws is None:
+        with _lock:
+            _undeliverable[_label(payload)] += 1
+        logger.warning("undeliverable %s: no destination", _label(payload))
+        return False
+    if isinstance(ws, Route):
+        return ws.send(payload)
+    try:
+        ws.send(_encode(payload))
+    except Exception as e:
+        with _lock:
+            _failed[_label(payload)] += 1
+        logger.warning("send %s failed: %s", _label(payload), e)
+        return False
+    with _lock:
+        _delivered += 1
+    return True
+
+
+def deliver(session: str, payload) -> bool:
+    with _lock:
+        ws = _sinks.get(session)
+    if ws is None:
+        with _lock:
+            _undeliverable[_label(payload)] += 1
+        logger.warning("undeliverable %s: session %s is gone", _label(payload), session)
+        return False
+    return send(ws, payload)
+
+
+class Route:
+    """
+    按 session 投递的句柄：接口同 ws.send，每次发送时才查登记表。
+    session 是每条连接自己生成的 uuid，重连会拿到新 session，所以 Route 不会跟到新连接上；
+    它保证的是连接断开后迟到的回复计入 undeliverable，而不是发到已关闭的 ws 上抛异常。
+    """
+
+    __slots__ = ("session",)
+
+    def __init__(self, session: str):
+        self.session = session
+
+    def send(self, payload) -> bool:
+        return deliver(self.session, payload)
+
+    def __repr__(self):
+        return f"Route({self.session})"
+
+
+def route(session: str) -> Route:
+    return Route(session)
+
+
+def stats() -> dict:
+    with _lock:
+        return {"sessions": len(_sinks), "delivered": _delivered,
+                "undeliverable": dict(_undeliverable), "failed": dict(_failed)}
@@ -0,0 +1,75 @@
+# mock_doubao_server.py
+# 本地豆包 ASR 替身服务器：说同样的 4 字节头 + 长度 + gzip 二进制帧，
+# 用来在没有网络 / 不消耗额度时调试 senddoubao（整段与流式两种模式）。
+#
+#   python mock_doubao_server.py            # 监听 ws://127.0.0.1:5002/api/v2/asr
+#   DOUBAO_WS_URL=ws://127.0.0.1:5002/api/v2/asr python vad_asr.py
+#
+# 每个音频包回一个中间结果 (sequence>0)，收到 last 包后回最终结果 (sequence<0)，
+# 文本是收到的音频时长，便于核对分包是否完整；解不开的帧回错误帧。
+
+import gzip
+import json
+import logging
+
+from geventwebsocket import WebSocketApplication, Resource, WebSocketServer
+
+import doubao_codec as dc
+from senddoubao import RATE, BITS, CHANNEL
+
+logger = logging.getLogger("mock_doubao")
+
+
+def build_response(resp: dict) -> bytes:
+    comp = gzip.compress(json.dumps(resp, ensure_ascii=False).encode("utf-8"))
+    return dc.encode(dc.MSG_FULL_SERVER, comp, serialization=dc.SER_JSON, compression=dc.COMP_GZIP)
+
+
+class MockASRApp(WebSocketApplication):
+    def on_open(self):
+        self.reqid = ""
+        self.seq = 0
+        self.audio_bytes = 0
+
+    def on_message(self, msg):
+        if not isinstance(msg, (bytes, bytearray)):
+            return
+        try:
+            frame = dc.decode(msg)
+            payload = frame.data()
+        except Exception as e:
+            self.ws.send(dc.encode_error(45000001, f"bad frame: {e}"), binary=True)
+            return
+
+        if frame.msg_type == dc.MSG_FULL_CLIENT:
+            req = json.loads(payload.decode("utf-8"))
+            self.reqid = req.get("request", {}).get("reqid", "")
+            logger.info("full request: %s", req.get("audio"))
+            return
+        if frame.msg_type != dc.MSG_AUDIO_ONLY:
+            return
+
+        self.seq += 1
+        self.audio_bytes += len(payload)
+        last = frame.last
+        ms = self.audio_bytes * 1000 // (RATE * CHANNEL * (BITS // 8))
+        self.ws.send(build_response({
+            "reqid": self.reqid,
+            "code": 1000,
+            "message": "Success",
+            "sequence": -self.seq if last else self.seq,
+            "result": [{"text": f"收到{ms}毫秒音频"}],
+        }), binary=True)
+
+
+def serve(host: str = "127.0.0.1", port: int = 5002) -> WebSocketServer:
+    """启动替身服务器（非阻塞），返回 server 以便调用方 stop()"""
+    server = WebSocketServer((host, port), Resource({"/api/v2/asr": MockASRApp}))
+    server.start()
+    return server
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logger.info("🚀 豆包替身服务器：ws://127.0.0.1:5002/api/v2/asr")
+    serve().serve_forever()
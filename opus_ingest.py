@@ -0,0 +1,120 @@
+# opus_ingest.py
+# /vad_asr 的 Opus 上行：每连接一个解码器，解码结果直接进 VAD 分帧；
+# 同时按 utterance 保留原始 Opus 包，可封装成 Ogg Opus 上传 ASR，省掉 PCM 的 10 倍带宽。
+# 依赖 opuslib（libopus 的 Python 绑定），未安装时 OPUS_AVAILABLE=False，服务器仍只收 PCM。
+
+import math
+import struct
+from collections import deque
+from typing import List
+
+from audio_buffer import UTT_MAX_MS, UTT_PREROLL_MS
+
+try:
+    import opuslib
+except Exception:  # 可选依赖；未装 libopus 时 opuslib 抛的是普通 Exception
+    opuslib = None
+
+OPUS_AVAILABLE = opuslib is not None
+FRAME_DURATIONS = (10, 20, 40, 60, 120)   # 设备可声明的 Opus 帧长 (ms)
+
+_OGG_GRANULE_RATE = 48000  # Ogg Opus 的 granule 固定按 48 kHz 计
+_PRE_SKIP = 312
+
+
+class OpusIngest:
+    """
+    - decode(packet) 返回 16bit PCM bytes；
+    - 空闲时只保留覆盖最近 preroll_ms 所需的最少包数，start() 后开始累积本句的包（最多 max_ms）；
+      两者默认与 UtteranceBuffer 相同（UTT_PREROLL_MS / UTT_MAX_MS），Opus 与 PCM 的句子从同一处开头；
+    - take() 取出本句全部包并回到空闲。
+    """
+
+    def __init__(self, sample_rate: int = 16000, channels: int = 1, frame_duration: int = 60,
+                 preroll_ms: int = UTT_PREROLL_MS, max_ms: int = UTT_MAX_MS):
+        if opuslib is None:
+            raise RuntimeError("opuslib 未安装：pip install opuslib")
+        if frame_duration not in FRAME_DURATIONS:
+            raise ValueError(f"bad Opus frame_duration: {frame_duration!r}")
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frame_duration = frame_duration
+        self.decoder = opuslib.Decoder(sample_rate, channels)
+        self._max_samples = sample_rate * 120 // 1000   # Opus 单包最长 120ms
+        self._preroll = deque(maxlen=max(math.ceil(preroll_ms / frame_duration), 1))
+        self._max_packets = max_ms // frame_duration
+        self._packets: List[bytes] = []
+        self.capturing = False
+
+    def decode(self, packet) -> bytes:
+        packet = bytes(packet)
+        pcm = self.decoder.decode(packet, self._max_samples)
+        if not self.capturing:
+            self._preroll.append(packet)
+        elif len(self._packets) < self._max_packets:
+            self._packets.append(packet)
+        return pcm
+
+    def start(self, preroll: bool = True):
+        self._packets = list(self._preroll) if preroll else []
+        self._preroll.clear()
+        self.capturing = True
+
+    def take(self) -> List[bytes]:
+        packets, self._packets = self._packets, []
+        self.capturing = False
+        return packets
+
+    def to_ogg(self, packets: List[bytes]) -> bytes:
+        return ogg_opus_stream(packets, self.sample_rate, self.channels, self.frame_duration)
+
+
+# ─────────────────── Ogg Opus 封装 (RFC 7845) ───────────────────
+
+def _crc_table():
+    table = []
+    for i in range(256):
+        r = i << 24
+        for _ in range(8):
+            r = ((r << 1) ^ 0x04C11DB7) if r & 0x80000000 else (r << 1)
+        table.append(r & 0xFFFFFFFF)
+    return table
+
+_CRC_TABLE = _crc_table()
+
+
+def _ogg_crc(data: bytes) -> int:
+    crc = 0
+    for b in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ _CRC_TABLE[((crc >> 24) & 0xFF) ^ b]
+    return crc
+
+
+def _ogg_page(packets: List[bytes], granule: int, serial: int, seq: int, flags: int) -> bytes:
+    lacing = bytearray()
+    for p in packets:
+        lacing += b"\xff" * (len(p) // 255) + bytes([len(p) % 255])
+    header = struct.pack("<4sBBqIIIB", b"OggS", 0, flags, granule, serial, seq, 0, len(lacing))
+    page = bytearray(header + lacing + b"".join(packets))
+    struct.pack_into("<I", page, 22, _ogg_crc(page))
+    return bytes(page)
+
+
+def ogg_opus_stream(packets: List[bytes], sample_rate: int = 16000, channels: int = 1,
+                    frame_duration: int = 60, serial: int = 0x507572) -> bytes:
+    """把一句话的原始 Opus 包封装成完整的 Ogg Opus 字节流（OpusHead + OpusTags + 音频页）"""
+    head = struct.pack("<8sBBHIhB", b"OpusHead", 1, channels, _PRE_SKIP, sample_rate, 0, 0)
+    vendor = b"purple"
+    tags = b"OpusTags" + struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", 0)
+    out = [_ogg_page([head], 0, serial, 0, 0x02), _ogg_page([tags], 0, serial, 1, 0)]
+
+    step = frame_duration * _OGG_GRANULE_RATE // 1000
+    granule, seq, page, segs = 0, 2, [], 0
+    for p in packets:
+        n = len(p) // 255 + 1
+        if page and segs + n > 255:
+            out.append(_ogg_page(page, granule, serial, seq, 0))
+            seq += 1; page, segs = [], 0
+        page.append(p); segs += n; granule += step
+    out.append(_ogg_page(page, granule, serial, seq, 0x04))
+    return b"".join(out)
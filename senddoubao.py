@@ -1,11 +1,25 @@
 import websocket
-import gzip
 import json
-import struct
+import logging
+import os
+import threading
+import time
 import uuid
+import zlib
+from collections import deque
+
+import gevent
+from gevent.event import AsyncResult, Event
+from gevent.lock import RLock
+from gevent.queue import Queue
+
+import doubao_codec as dc
+from config_loader import config
+
+logger = logging.getLogger("senddoubao")
 
 # ====== 配置 ======
-WS_URL    = "wss://openspeech.bytedance.com/api/v2/asr"   # 控制台提供的 WS 地址
+WS_URL    = os.getenv("DOUBAO_WS_URL", "wss://openspeech.bytedance.com/api/v2/asr")   # 控制台提供的 WS 地址，可指向本地替身服务器
 APPID     = "4911487570"                                 # 你的 AppID
 TOKEN     = "zpAFYBQB7Nuy0stP6jPITrXPvCtN7VF4"           # 你的 Token
 AUTH_HDR  = f"Authorization: Bearer; {TOKEN}"            # 握手鉴权头
@@ -18,36 +32,98 @@ CHANNEL  = 1        # 声道数
 FORMAT   = "wav"    # 容器格式
 CODEC    = "raw"    # 编码格式
 CHUNK_MS = 200      # 每包时长（毫秒）
+CHUNK_BYTES = RATE * CHANNEL * (BITS // 8) * CHUNK_MS // 1000
+
+# 预热连接池：常驻几条已握手鉴权的连接（0 关闭），空闲超过多少秒换新
+ASR_POOL_SIZE     = int(os.getenv("ASR_POOL_SIZE", "2"))
+ASR_POOL_MAX_IDLE = float(os.getenv("ASR_POOL_MAX_IDLE", "15"))
+
+# 负载压缩：az_agent.yaml 的 senddoubao.compress / compress_level，
+# 环境变量 ASR_COMPRESS / ASR_COMPRESS_LEVEL 优先
+#   off / false   不压缩（头部 compression=0）
+#   gzip / true   每包 gzip
+#   adaptive / block  每包只压一遍，省不到 10% 的包丢掉压缩结果、原样发送
+_CFG = config.get("senddoubao") or {}
+ASR_COMPRESS       = os.getenv("ASR_COMPRESS", str(_CFG.get("compress", "gzip")))
+ASR_COMPRESS_LEVEL = int(os.getenv("ASR_COMPRESS_LEVEL", str(_CFG.get("compress_level", 1))))
+
+# 识别时限：最后一包发出后等最终结果的秒数 / 单句会话总秒数
+ASR_FINAL_TIMEOUT = float(os.getenv("ASR_FINAL_TIMEOUT", "5"))
+ASR_MAX_SESSION   = float(os.getenv("ASR_MAX_SESSION", "60"))
+
+
+class ASRError(RuntimeError):
+    """识别失败：服务端错误帧或连接中断"""
+
+
+class ASRTimeout(ASRError):
+    """最后一包发出后 final_timeout 内没等到最终结果"""
+
+
+class ASRCancelled(ASRError):
+    """会话被 cancel()，或超过 max_session"""
+
+
+class CompressionPolicy:
+    """
+    每个负载都是独立的 gzip 成员（服务端逐包解压），所以不能跨包共用一条压缩流：
+    每包从构造时建好的模板 copy() 一份 zlib 状态——整份状态照样要分配（每包几十 KB），
+    省掉的只是 gzip.compress 每次新建 GzipFile。
+    adaptive 与 gzip 一样只压一遍，省不到 min_saving 的包丢掉压缩结果、原样发送：
+    一包 6400 B 里 copy() 就占去大半耗时，先试压一段再压全包反而比直接压更慢。
+    encode(data) 返回 (头部 compression 位, 负载)。
+    """
+
+    MODES = {"off": "off", "false": "off", "none": "off", "0": "off",
+             "gzip": "gzip", "true": "gzip", "1": "gzip",
+             "adaptive": "adaptive", "block": "adaptive"}
+
+    def __init__(self, mode: str = ASR_COMPRESS, level: int = ASR_COMPRESS_LEVEL,
+                 min_saving: float = 0.1):
+        self.mode = self.MODES.get(str(mode).strip().lower())
+        if self.mode is None:
+            raise ValueError(f"unknown compress mode: {mode!r}")
+        self.level = level
+        self.min_saving = min_saving
+        self._template = zlib.compressobj(level, zlib.DEFLATED, 31)   # wbits=31: gzip 格式
+
+    def gzip(self, data) -> bytes:
+        c = self._template.copy()
+        return c.compress(data) + c.flush()
+
+    def encode(self, data):
+        if self.mode == "off":
+            return dc.COMP_NONE, data
+        out = self.gzip(data)
+        if self.mode == "adaptive" and len(out) > len(data) * (1 - self.min_saving):
+            return dc.COMP_NONE, data
+        return dc.COMP_GZIP, out
 
 
-def make_header(version: int, hdr_size: int, msg_type: int,
-                flags: int, serialization: int, compression: int) -> bytes:
-    b0 = ((version & 0xF) << 4) | (hdr_size & 0xF)
-    b1 = ((msg_type  & 0xF) << 4) | (flags     & 0xF)
-    b2 = ((serialization & 0xF) << 4) | (compression & 0xF)
-    return bytes([b0, b1, b2, 0x00])
+COMPRESSION = CompressionPolicy()
 
 
-def build_full_request(reqid: str) -> bytes:
+def build_full_request(reqid: str, fmt: str = FORMAT, codec: str = CODEC) -> bytes:
     body = {
         "app":     {"appid": APPID, "token": TOKEN, "cluster": "volcengine_input_common"},
         "user":    {"uid": UID},
-        "audio":   {"format": FORMAT, "codec": CODEC, "rate": RATE, "bits": BITS, "channel": CHANNEL},
+        "audio":   {"format": fmt, "codec": codec, "rate": RATE, "bits": BITS, "channel": CHANNEL},
         "request": {"reqid": reqid, "sequence": 1, "nbest": 1, "show_utterances": True}
     }
     raw = json.dumps(body, ensure_ascii=False).encode("utf-8")
-    comp = gzip.compress(raw)
-    hdr  = make_header(1, 1, 1, 0, 1, 1)  # JSON+Gzip
-    size = struct.pack(">I", len(comp))
-    return hdr + size + comp
+    ctype, comp = COMPRESSION.encode(raw)
+    return dc.encode(dc.MSG_FULL_CLIENT, comp, serialization=dc.SER_JSON, compression=ctype)
 
 
-def build_audio_request(chunk: bytes, seq: int, last: bool) -> bytes:
-    comp  = gzip.compress(chunk)
-    flags = 0b0010 if last else 0b0000
-    hdr   = make_header(1, 1, 2, flags, 0, 1)  # raw+Gzip
-    size  = struct.pack(">I", len(comp))
-    return hdr + size + comp
+def build_audio_request(chunk: bytes, seq: int, last: bool,
+                        policy: CompressionPolicy = None, encoder: dc.FrameEncoder = None):
+    """v2 音频包：序号只在客户端计数，头部不带 sequence，最后一包打 FLAG_LAST。
+    传入 encoder 时写进它的复用缓冲，返回的 memoryview 须在下次编码前发出"""
+    ctype, comp = (policy or COMPRESSION).encode(chunk)
+    flags = dc.FLAG_LAST if last else dc.FLAG_NONE
+    if encoder is not None:
+        return encoder.encode(dc.MSG_AUDIO_ONLY, comp, flags, compression=ctype)
+    return dc.encode(dc.MSG_AUDIO_ONLY, comp, flags, compression=ctype)
 
 
 def asr_once(path: str) -> str:
@@ -56,39 +132,360 @@ def asr_once(path: str) -> str:
     返回识别出的文本。
     """
     data = open(path, "rb").read()
+    return _recognize(data, FORMAT)
 
-    # 1. 建立 WS 连接并鉴权
-    ws = websocket.create_connection(WS_URL, header=[AUTH_HDR])
-
-    # 2. 发送 Full Client Request
-    reqid = uuid.uuid4().hex
-    ws.send(build_full_request(reqid), opcode=websocket.ABNF.OPCODE_BINARY)
-
-    # 3. 分包发送音频
-    per_byte = RATE * CHANNEL * (BITS//8) // 1000
-    chunk   = per_byte * CHUNK_MS
-    off, seq = 0, 1
-    while off < len(data):
-        end = min(off + chunk, len(data))
-        last = (end == len(data))
-        ws.send(build_audio_request(data[off:end], seq, last),
-                opcode=websocket.ABNF.OPCODE_BINARY)
-        off += chunk
-        seq += 1
-
-    # 4. 接收直到最终包 (sequence<0 && code==1000)
-    result = ""
+
+def asr_pcm(pcm, on_partial=None) -> str:
+    """
+    内存版一句话识别：直接接收 16k/16bit/mono 裸 PCM（bytes / bytearray / memoryview），
+    不落盘、不读盘。按 200ms 切片时对 memoryview 只做零拷贝切片。
+    on_partial(text) 收到中间结果时回调。
+    """
+    return _recognize(memoryview(pcm), "raw", on_partial=on_partial)
+
+
+def asr_ogg_opus(data: bytes, on_partial=None) -> str:
+    """Opus 上行的一句话识别：上传 Ogg Opus 字节流（opus_ingest.ogg_opus_stream 生成）"""
+    return _recognize(memoryview(data), "ogg", codec="opus", on_partial=on_partial)
+
+
+def _recognize(data, fmt: str, codec: str = CODEC, on_partial=None) -> str:
+    # 整段也走全双工会话：分包入队后由发送 greenlet 发出，接收同时进行
+    sess = StreamingASR(fmt=fmt, codec=codec, on_partial=on_partial).open()
+    sess.feed(data)
+    return sess.finish()
+
+
+def parse_response(msg):
+    """
+    解出服务端响应的 JSON；文本帧和不带结果的 ACK 返回 None，残缺帧抛 doubao_codec.CodecError。
+    错误帧转成 {"code", "message"}；"sequence" 统一成服务端语义（头部优先，负数为最终结果）。
+    """
+    if not isinstance(msg, (bytes, bytearray, memoryview)):
+        return None
+    frame = dc.decode(msg)
+    if frame.msg_type == dc.MSG_SERVER_ACK:
+        return None
+    resp = frame.json()
+    if not frame.is_error:
+        resp["sequence"] = dc.server_sequence(frame, resp)
+    return resp
+
+
+def response_text(resp: dict) -> str:
+    return ((resp.get("result") or [{}])[0]).get("text", "")
+
+
+def recv_final(ws) -> str:
+    """接收直到最终包 (sequence<0 && code==1000)，返回识别文本"""
     while True:
-        msg = ws.recv()
-        # 如果是二进制
-        if isinstance(msg, (bytes, bytearray)) and len(msg) >= 8:
-            size    = struct.unpack(">I", msg[4:8])[0]
-            payload = msg[8:8+size]
-            raw     = gzip.decompress(payload)
-            resp    = json.loads(raw.decode("utf-8", errors="ignore"))
-            if resp.get("code")==1000 and resp.get("sequence",0)<0:
-                result = resp["result"][0]["text"]
-                break
-        # 否则跳过
-    ws.close()
-    return result
+        resp = parse_response(ws.recv())
+        if resp and resp.get("code")==1000 and resp.get("sequence",0)<0:
+            return response_text(resp)
+
+
+# ====== 连接池 ======
+
+def _connect(url: str = WS_URL):
+    return websocket.create_connection(url, header=[AUTH_HDR])
+
+
+def _close(ws):
+    try: ws.close()
+    except Exception: pass
+
+
+class ASRConnectionPool(threading.Thread):
+    """
+    后台线程维持 size 条已完成 TCP/TLS/WS 握手和鉴权的空闲连接：
+    1. acquire() 取出一条（命中），池空时当场新建（未命中）；每条连接只识别一句
+    2. 取走后立即补位；空闲超过 max_idle 的连接在后台关掉换新，服务端踢掉的在取出时丢弃
+    3. stats() 导出命中 / 未命中 / 过期与握手耗时
+    """
+
+    def __init__(self, url: str = WS_URL, size: int = ASR_POOL_SIZE,
+                 max_idle: float = ASR_POOL_MAX_IDLE, daemon: bool = True):
+        super().__init__(daemon=daemon)
+        self.url = url
+        self.size = size
+        self.max_idle = max_idle
+        self._idle = deque()            # (建立时间, ws)，左边最旧
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self.hits = self.misses = self.stale = self.failures = 0
+        self.handshakes = 0
+        self.handshake_sum = self.handshake_max = 0.0
+        self._wake.set()                # 启动即预热
+        self.start()
+
+    # ------------  PUBLIC  -------------
+    def acquire(self):
+        """返回 (ws, pooled)；pooled=True 表示来自池，调用方发送失败时可换新连接重试"""
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                opened, ws = self._idle.popleft()
+                if now - opened < self.max_idle and ws.connected:
+                    self.hits += 1
+                    self._wake.set()
+                    return ws, True
+                self.stale += 1
+                _close(ws)
+            self.misses += 1
+        self._wake.set()
+        return self.handshake(), False
+
+    def handshake(self):
+        t0 = time.monotonic()
+        ws = _connect(self.url)
+        dt = time.monotonic() - t0
+        with self._lock:
+            self.handshakes += 1
+            self.handshake_sum += dt
+            self.handshake_max = max(self.handshake_max, dt)
+        return ws
+
+    def mark_stale(self):
+        with self._lock:
+            self.stale += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            n = self.hits + self.misses
+            return {
+                "idle": len(self._idle), "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / n, 3) if n else 0.0,
+                "stale": self.stale, "failures": self.failures,
+                "handshakes": self.handshakes,
+                "avg_handshake_ms": round(self.handshake_sum / max(self.handshakes, 1) * 1000, 1),
+                "max_handshake_ms": round(self.handshake_max * 1000, 1),
+            }
+
+    # ------------  THREAD LOOP  --------
+    def run(self):
+        backoff = 0.5
+        while True:
+            self._wake.wait(timeout=self.max_idle / 3)
+            self._wake.clear()
+            self._expire()
+            while len(self._idle) < self.size:
+                try:
+                    ws = self.handshake()
+                except Exception as e:
+                    with self._lock:
+                        self.failures += 1
+                    logger.warning("ASR pool handshake failed: %s, retry in %.1fs", e, backoff)
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, 30.0)
+                    break
+                backoff = 0.5
+                with self._lock:
+                    self._idle.append((time.monotonic(), ws))
+
+    # ------------  INTERNAL  -----------
+    def _expire(self):
+        """把快到 max_idle 的最旧连接提前关掉，由补位循环换成新的"""
+        deadline = time.monotonic() - self.max_idle * 0.8
+        with self._lock:
+            while self._idle and self._idle[0][0] < deadline:
+                _close(self._idle.popleft()[1])
+
+
+POOL = None
+
+
+def start_pool(size: int = ASR_POOL_SIZE):
+    """服务启动时调用：建池并开始预热；size<=0 时不建池，每句现连"""
+    global POOL
+    if POOL is None and size > 0:
+        POOL = ASRConnectionPool(size=size)
+    return POOL
+
+
+def pool_stats() -> dict:
+    return POOL.stats() if POOL is not None else {}
+
+
+def _pool_for(url: str):
+    return POOL if POOL is not None and url == POOL.url else None
+
+
+def open_session(req: bytes, url: str = WS_URL):
+    """
+    取一条连接并发出 Full Client Request（build_full_request 生成），返回 (ws, pooled)。
+    池里的连接可能已被服务端关掉，发送失败时换一条新建的连接重试一次。
+    注意被服务端半关闭的连接多半仍能 send 成功（字节只是进了内核缓冲），要到读响应时才失败——
+    pooled=True 时调用方需在收到第一个响应前准备好换连接重放，见 StreamingASR._reopen。
+    """
+    pool = _pool_for(url)
+    ws, pooled = pool.acquire() if pool is not None else (_connect(url), False)
+    try:
+        ws.send(req, opcode=websocket.ABNF.OPCODE_BINARY)
+    except Exception:
+        _close(ws)
+        if not pooled:
+            raise
+        pool.mark_stale()
+        ws, pooled = pool.handshake(), False
+        ws.send(req, opcode=websocket.ABNF.OPCODE_BINARY)
+    return ws, pooled
+
+
+class StreamingASR:
+    """
+    全双工识别会话（在 gevent monkey patch 之后使用）：
+    - open() 从连接池取一条已鉴权的连接并发 Full Request，同时起发送 / 接收两个 greenlet；
+    - feed() 只把 PCM 按 CHUNK_MS 切包入队就返回，发送 greenlet 按序发出；
+    - 接收 greenlet 边发边读：中间结果交给 on_partial(text)，最终结果或错误帧写入 result；
+    - finish() 把剩余音频作为 last 包入队；last 包发出后最多再等 final_timeout 秒（排队上传的时间只受 max_session 限制）；
+    - 会话总时长超过 max_session 或 cancel() 时关连接并结束两个 greenlet；
+    - 池里取出的连接在收到第一个响应前收发失败，视为服务端早已关掉的陈旧连接：
+      新握手一条，重放 Full Request 和已发出的音频包，只重放一次。
+    一句一个会话，很多句可以同时跑在同一个 hub 上，不必各占一个阻塞线程。
+    feed() 的整包以 memoryview 引用入队，发出前调用方不要改写这块内存。
+    """
+
+    def __init__(self, url: str = WS_URL, fmt: str = "raw", codec: str = CODEC, on_partial=None,
+                 final_timeout: float = ASR_FINAL_TIMEOUT, max_session: float = ASR_MAX_SESSION):
+        self.url = url
+        self.fmt = fmt
+        self.codec = codec
+        self.on_partial = on_partial
+        self.final_timeout = final_timeout
+        self.max_session = max_session
+        self.ws = None
+        self.seq = 1
+        self.result = AsyncResult()
+        self._out = Queue()
+        self._enc = dc.FrameEncoder()
+        self._pending = bytearray()
+        self._tasks = []
+        self._io = RLock()          # 发包与换连接重放互斥
+        self._req = None
+        self._pooled = False
+        self._replay = []           # 收到第一个响应前已发出的 (chunk, last)，之后置 None
+        self._sent_last = Event()   # last 包已经发出：final_timeout 从这时算起
+
+    def open(self):
+        self._req = build_full_request(uuid.uuid4().hex, fmt=self.fmt, codec=self.codec)
+        self.ws, self._pooled = open_session(self._req, self.url)
+        self._tasks = [gevent.spawn(self._send_loop), gevent.spawn(self._recv_loop),
+                       gevent.spawn_later(self.max_session, self.cancel, "max_session")]
+        return self
+
+    def feed(self, pcm):
+        """满一包就入队；最后一包总留给 finish() 带 last 标志发出"""
+        view = memoryview(pcm)
+        if self._pending:
+            need = CHUNK_BYTES - len(self._pending)
+            self._pending += view[:need]
+            view = view[need:]
+            if not len(view):
+                return
+            self._out.put((bytes(self._pending), False))
+            self._pending.clear()
+        off = 0
+        while len(view) - off > CHUNK_BYTES:
+            self._out.put((view[off:off + CHUNK_BYTES], False))
+            off += CHUNK_BYTES
+        self._pending += view[off:]
+
+    def finish(self) -> str:
+        self._out.put((bytes(self._pending), True))
+        self._pending.clear()
+        try:
+            # 长句可能还有几十包排着队：先等 last 包发出（或会话已出结果 / 出错），上限 max_session，
+            # 再开始最多 final_timeout 秒的最终结果等待
+            gevent.wait([self._sent_last, self.result], count=1, timeout=self.max_session)
+            if not (self._sent_last.is_set() or self.result.ready()):
+                raise ASRTimeout(f"last packet not sent within {self.max_session}s")
+            return self.result.get(timeout=self.final_timeout)
+        except gevent.Timeout:
+            raise ASRTimeout(f"no final result within {self.final_timeout}s")
+        finally:
+            self.close()
+
+    def cancel(self, reason: str = "cancelled"):
+        self._fail(ASRCancelled(reason))
+        self.close()
+
+    def close(self):
+        if self.ws is not None:
+            _close(self.ws)
+            self.ws = None
+        me = gevent.getcurrent()
+        for t in self._tasks:
+            if t is not me:
+                t.kill(block=False)
+
+    def _fail(self, exc: Exception):
+        if not self.result.ready():
+            self.result.set_exception(exc)
+
+    def _send_audio(self, chunk, last: bool):
+        self.ws.send(build_audio_request(chunk, self.seq, last, encoder=self._enc),
+                     opcode=websocket.ABNF.OPCODE_BINARY)
+        self.seq += 1
+
+    def _reopen(self, exc: Exception) -> bool:
+        """池里的连接还没收到任何响应就失败：换新连接重放 Full Request 和已发音频，返回是否已重放"""
+        with self._io:
+            pool = _pool_for(self.url)
+            if not self._pooled or self._replay is None or pool is None or self.ws is None:
+                return False
+            self._pooled = False    # 只重放一次
+            logger.info("pooled ASR connection stale (%s), replaying %d packets", exc, len(self._replay))
+            pool.mark_stale()
+            _close(self.ws)
+            self.ws = pool.handshake()
+            self.ws.send(self._req, opcode=websocket.ABNF.OPCODE_BINARY)
+            self.seq = 1
+            for chunk, last in self._replay:
+                self._send_audio(chunk, last)
+            return True
+
+    def _send_loop(self):
+        try:
+            while True:
+                chunk, last = self._out.get()
+                with self._io:
+                    if self._replay is not None:
+                        self._replay.append((chunk, last))
+                    try:
+                        self._send_audio(chunk, last)
+                    except Exception as e:
+                        if not self._reopen(e):     # 重放已包含这一包
+                            raise
+                if last:
+                    self._sent_last.set()
+                    return
+        except Exception as e:
+            self._fail(ASRError(f"send failed: {e}"))
+
+    def _recv_loop(self):
+        try:
+            while True:
+                ws = self.ws
+                try:
+                    msg = ws.recv()
+                except Exception as e:
+                    if self.ws is not None and self.ws is not ws:
+                        continue            # 发送 greenlet 已经换了连接
+                    if self._reopen(e):
+                        continue
+                    raise
+                resp = parse_response(msg)
+                if resp is None:
+                    continue
+                self._replay = None         # 服务端已经在处理这条连接，不再需要重放
+                if resp.get("code") != 1000:
+                    self._fail(ASRError(f"server error {resp.get('code')}: {resp.get('message')}"))
+                    return
+                text = response_text(resp)
+                if resp.get("sequence", 0) < 0:
+                    self.result.set(text)
+                    return
+                if self.on_partial is not None:
+                    self.on_partial(text)
+        except Exception as e:
+            self._fail(ASRError(f"recv failed: {e}"))
@@ -0,0 +1,190 @@
+# utterance_shaper.py
+# 整句识别前的整形：逐帧记下 VAD 标签，提交前裁掉首尾非语音；长句说到 SEG_MAX_MS 后在自然停顿处切段，
+# 已切出的段在用户继续说话时就并行识别，句末只剩最后一段要等，结果按顺序拼回一句。
+#   SEG_ENABLE     1 开启切段（默认），0 整句一次识别（仍会裁剪首尾）
+#   SEG_MAX_MS     本段达到该时长后，遇到停顿就切（默认 8000）；缓冲写满（UTT_MAX_MS）时无停顿也切
+#   SEG_PAUSE_MS   视为自然停顿的连续静音时长（默认 240）
+#   TRIM_LEAD_MS   首个语音帧前保留的余量（默认 160）
+#   TRIM_TAIL_MS   末个语音帧后保留的余量（默认 240）
+
+import logging
+import os
+import re
+from collections import deque
+from typing import List, Tuple
+
+logger = logging.getLogger("utterance_shaper")
+
+SEG_ENABLE = os.getenv("SEG_ENABLE", "1") == "1"
+SEG_MAX_MS = int(os.getenv("SEG_MAX_MS", "8000"))
+SEG_PAUSE_MS = int(os.getenv("SEG_PAUSE_MS", "240"))
+TRIM_LEAD_MS = int(os.getenv("TRIM_LEAD_MS", "160"))
+TRIM_TAIL_MS = int(os.getenv("TRIM_TAIL_MS", "240"))
+
+_BYTES_PER_MS = 32  # 16 kHz / 16 bit / mono
+
+
+class FrameLabels:
+    """
+    与 UtteranceBuffer 并行的逐帧标签 (字节数, 是否语音)。
+    缓冲开头可能是被截过的 pre-roll，所以标签一律从末尾往前对齐。
+    空闲时只保留约 preroll 长度的标签，start() 后累积本段的全部标签。
+    """
+
+    def __init__(self, preroll_bytes: int, frame_bytes: int = 1024,
+                 lead_ms: int = TRIM_LEAD_MS, tail_ms: int = TRIM_TAIL_MS):
+        self._idle = deque(maxlen=preroll_bytes // frame_bytes + 1)
+        self._labels = []
+        self.capturing = False
+        self.lead = lead_ms * _BYTES_PER_MS
+        self.tail = tail_ms * _BYTES_PER_MS
+
+    def write(self, nbytes: int, voiced: bool):
+        (self._labels if self.capturing else self._idle).append((nbytes, voiced))
+
+    def start(self, preroll: bool = True):
+        self._labels = list(self._idle) if preroll else []
+        self._idle.clear()
+        self.capturing = True
+
+    def reset(self):
+        self._labels = []
+        self.capturing = False
+
+    def bounds(self, total: int) -> Tuple[int, int]:
+        """
+        本段要保留的字节范围 [lo, hi)：首个语音帧前 lead、末个语音帧后 tail。
+        没有任何标签（如 manual 模式不跑 VAD）或没有语音帧时保留整段。
+        """
+        end, first, last = total, None, None
+        for nbytes, voiced in reversed(self._labels):
+            start = end - nbytes
+            if voiced:
+                if last is None:
+                    last = end
+                first = start
+            end = start
+            if end <= 0:
+                break
+        if last is None:
+            return 0, total
+        lo = max(0, first - self.lead) & ~1
+        hi = min(total, last + self.tail) & ~1
+        return lo, hi
+
+
+def trim_packets(packets: List[bytes], total: int, lo: int, hi: int, packet_bytes: int) -> List[bytes]:
+    """按 PCM 裁剪范围丢掉首尾整包 Opus（包与 PCM 同样从末尾对齐），保留与 [lo, hi) 有重叠的包"""
+    keep_tail = (total - hi) // packet_bytes
+    keep_head = max(len(packets) - (total - lo + packet_bytes - 1) // packet_bytes, 0)
+    return packets[keep_head:len(packets) - keep_tail]
+
+
+_ASCII_WORD = re.compile(r"[A-Za-z0-9]")
+
+
+def join_texts(parts: List[str]) -> str:
+    """按顺序拼接各段文本；两段交界都是英文/数字时补一个空格"""
+    out = ""
+    for p in parts:
+        p = (p or "").strip()
+        if not p:
+            continue
+        if out and _ASCII_WORD.match(out[-1]) and _ASCII_WORD.match(p[0]):
+            out += " "
+        out += p
+    return out
+
+
+class SegmentStitcher:
+    """
+    一句话的各段识别任务（gevent Greenlet）按提交顺序登记；close() 之后全部完成即拼接，
+    交给 on_text(text)。失败的段按空文本处理并记日志，全部失败时不回调。
+    """
+
+    def __init__(self, on_text):
+        self.on_text = on_text
+        self._parts = []
+        self._pending = 0
+        self._failed = 0
+        self._closed = False
+
+    def __len__(self) -> int:
+        return len(self._parts)
+
+    def add(self, job):
+        idx = len(self._parts)
+        self._parts.append("")
+        self._pending += 1
+        job.link(lambda j: self._done(idx, j))
+
+    def close(self):
+        self._closed = True
+        self._maybe_finish()
+
+    def _done(self, idx: int, job):
+        self._pending -= 1
+        if job.successful():
+            self._parts[idx] = job.value or ""
+        else:
+            self._failed += 1
+            logger.error("[ASR ERROR] segment %d/%d: %s", idx + 1, len(self._parts), job.exception)
+        self._maybe_finish()
+
+    def _maybe_finish(self):
+        if not self._closed or self._pending:
+            return
+        if self._failed == len(self._parts):
+            return
+        self.on_text(join_texts(self._parts))
+
+
+class PartialText:
+    """
+    一句话的中间结果：segment(idx) 给第 idx 段一个 on_partial 回调（idx 缺省为下一段，与 SegmentStitcher 的登记顺序一致），
+    段内新结果覆盖该段旧结果，整句文本按段序拼接；拼接结果变化时回调 on_text(text)，text 属性始终是当前整句文本。
+    同一 idx 可以取多次（流式失败后整句重识别），结果仍落在该段。
+    """
+
+    def __init__(self, on_text=None):
+        self.on_text = on_text
+        self.text = ""
+        self._parts = []
+
+    def segment(self, idx: int = None):
+        if idx is None:
+            idx = len(self._parts)
+        while len(self._parts) <= idx:
+            self._parts.append("")
+
+        def on_partial(text):
+            if not text or text == self._parts[idx]:
+                return
+            self._parts[idx] = text
+            joined = join_texts(self._parts)
+            if joined != self.text:
+                self.text = joined
+                if self.on_text is not None:
+                    self.on_text(joined)
+        return on_partial
+
+
+class ShaperStats:
+    """进程级统计：裁剪前后的字节数与切段次数"""
+
+    def __init__(self):
+        self.utterances = self.segments = self.splits = 0
+        self.bytes_in = self.bytes_out = 0
+
+    def record(self, before: int, after: int):
+        self.segments += 1
+        self.bytes_in += before
+        self.bytes_out += after
+
+    def snapshot(self) -> dict:
+        saved = 1 - self.bytes_out / self.bytes_in if self.bytes_in else 0.0
+        return {"utterances": self.utterances, "segments": self.segments, "splits": self.splits,
+                "bytes_in": self.bytes_in, "bytes_out": self.bytes_out, "saved": round(saved, 3)}
+
+
+STATS = ShaperStats()
@@ -1,22 +1,37 @@
-import os, json, threading, logging, time, uuid, wave, concurrent.futures
-from collections import deque
-from typing import List, Set
+import os, json, threading, logging, time, uuid, concurrent.futures
+from typing import Set
 from gevent import monkey; monkey.patch_all()
+import gevent
+from gevent.event import AsyncResult
+from gevent.queue import Queue, Empty
+from gevent.threadpool import ThreadPool
 from geventwebsocket import WebSocketApplication, Resource, WebSocketServer
 import numpy as np
 import onnxruntime
-from senddoubao import asr_once
+from asr_backend import make_backend
+from audio_archive import make_archiver
+from audio_buffer import UtteranceBuffer
+from endpointer import Endpointer
+import utterance_shaper as shaper
+from opus_ingest import OpusIngest, OPUS_AVAILABLE, FRAME_DURATIONS
+import xiaozhi_protocol as xz
+import event_bus
+import http_client
+import message_router
+import memory_cache
 from memorymanager import append_memory, append_vision_memory
-from camelfunc import handle_user_text
+from camelfunc import handle_user_text, intent_stats
 import base64, requests, atexit
 from io import BytesIO
 from apscheduler.schedulers.background import BackgroundScheduler
 from PIL import Image
 from vision_utils import process_base64_image, start_cleanup_scheduler
-from llm_client import chat_with_dify
+from llm_client import chat_with_dify, stream_stats
 # Globals
 WS_POOL: Set[WebSocketApplication] = set()
 EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+ARCHIVER = make_archiver()  # 可选：ASR_ARCHIVE_DIR 设置后异步归档每段语音
+ASR = make_backend()        # az_agent.yaml asr.backend：doubao / local / hedged
 
 # Logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
@@ -25,12 +40,105 @@ logger = logging.getLogger(__name__)
 # VAD
 _RATE = 16000; _MAX_WAV = 32767; _ONNX_PATH = "silero_vad_16k.onnx"
 _CONTEXT_SIZE = 128; _CHUNK_SAMPLES = 512; _CHUNK_BYTES = _CHUNK_SAMPLES * 2
-_SILENCE_THRESHOLD = 1.5; WINDOW_SIZE = 10; MIN_VOICE_FRAMES = 6
+# 流式 ASR：开口即建连，边说边传（仅支持流式的后端生效）
+ASR_STREAMING = os.getenv("ASR_STREAMING", "0") == "1"
+# Opus 上行时直接把原始包封装成 Ogg Opus 上传 ASR（否则上传解码后的 PCM）
+ASR_UPLOAD_OPUS = os.getenv("ASR_UPLOAD_OPUS", "1") == "1"
+
+# 跨连接批量推理：微窗口(ms) / 单批上限 / 开关
+VAD_BATCHING = os.getenv("VAD_BATCHING", "1") == "1"
+VAD_BATCH_WINDOW_MS = float(os.getenv("VAD_BATCH_WINDOW_MS", "4"))
+VAD_BATCH_MAX = int(os.getenv("VAD_BATCH_MAX", "64"))
+# ONNX 推理放到原生线程池，hub 只负责收发；0 表示在 hub 上直接推理
+VAD_WORKERS = int(os.getenv("VAD_WORKERS", str(os.cpu_count() or 1)))
+# 每个连接排队等待 VAD 的音频帧上限，满了就对该连接的读取反压
+VAD_MAX_INFLIGHT = int(os.getenv("VAD_MAX_INFLIGHT", "8"))
+VAD_POOL = ThreadPool(VAD_WORKERS) if VAD_WORKERS > 0 else None
+
+def _offload(fn, *args):
+    """在 VAD 线程池里执行 fn 并等待结果（只挂起当前 greenlet）"""
+    return VAD_POOL.apply(fn, args) if VAD_POOL is not None else fn(*args)
+# 零分配模式：预分配缓冲 + IOBinding
+VAD_ZERO_ALLOC = os.getenv("VAD_ZERO_ALLOC", "0") == "1"
+# 能量预门限：明显静音的 chunk 不跑 ONNX
+VAD_GATE = os.getenv("VAD_GATE", "1") == "1"
+
+class EnergyGate:
+    """
+    Silero 前的级联能量门：RMS + 过零率 + 自适应噪声底（每个连接一个实例）。
+    - rms 低于 max(abs_floor, noise_floor * margin) 判为明显静音；
+      rms 不到阈值 2 倍但过零率高于 max_zcr 的宽带嘶声也判静音；
+    - 噪声底只在非语音 chunk 上做 EMA 更新，下降方向快速跟随；
+    - Silero 判出语音后 hangover 个 chunk 内门限常开，保证起止音不被截掉。
+    """
+    def __init__(self, enabled=True, abs_floor=80.0, margin_db=6.0, max_zcr=0.35,
+                 noise_alpha=0.05, hangover=10, reset_after=30):
+        self.enabled = enabled
+        self.abs_floor = abs_floor          # int16 幅度下的 RMS 绝对下限
+        self.margin_db = margin_db
+        self.max_zcr = max_zcr
+        self.noise_alpha = noise_alpha
+        self.hangover = hangover            # chunk 数
+        self.reset_after = reset_after      # 连续跳过多少 chunk 后重置 Silero state
+        self.noise_floor = abs_floor
+        self.run = 0; self._open = 0; self._rms = 0.0
+        self.total = 0; self.skipped = 0
+        # 按 chunk 长度预分配的工作缓冲，热路径上不再每个 chunk 分配数组
+        self._f32 = np.empty(0, np.float32); self._neg = np.empty(0, np.bool_); self._flip = np.empty(0, np.bool_)
+    PARAMS = ("enabled", "abs_floor", "margin_db", "max_zcr", "noise_alpha", "hangover", "reset_after")
+    _BOOLS = {"1": True, "true": True, "yes": True, "on": True, "0": False, "false": False, "no": False, "off": False}
+    def configure(self, **params):
+        """客户端 vad_config 下发的参数：布尔按字面解析（"false" / "0" 为关），解析不了的记日志跳过"""
+        for k, v in params.items():
+            if k not in self.PARAMS: continue
+            cur = getattr(self, k)
+            try:
+                if isinstance(cur, bool): v = v if isinstance(v, bool) else self._BOOLS[str(v).strip().lower()]
+                else: v = type(cur)(v)
+            except (KeyError, TypeError, ValueError):
+                logger.warning(f"[gate] ignore bad {k}={v!r}"); continue
+            setattr(self, k, v)
+    def should_skip(self, audio) -> bool:
+        self.total += 1
+        if not self.enabled: return False
+        x = np.frombuffer(audio, dtype=np.int16)
+        if x.size < 2: return False
+        if self._f32.size != x.size:
+            self._f32 = np.empty(x.size, np.float32)
+            self._neg = np.empty(x.size, np.bool_); self._flip = np.empty(x.size - 1, np.bool_)
+        f = self._f32; np.copyto(f, x)
+        rms = float(np.sqrt(np.dot(f, f) / x.size))
+        neg = np.less(x, 0, out=self._neg)
+        zcr = np.count_nonzero(np.not_equal(neg[1:], neg[:-1], out=self._flip)) / (x.size - 1)
+        self._rms = rms
+        if self._open > 0:
+            self._open -= 1; self.run = 0
+            return False
+        thr = max(self.abs_floor, self.noise_floor * 10 ** (self.margin_db / 20))
+        if rms < thr or (rms < thr * 2 and zcr > self.max_zcr):
+            self._track_noise(rms)
+            self.run += 1; self.skipped += 1
+            return True
+        self.run = 0
+        return False
+    def observe(self, voiced: bool):
+        """Silero 跑过的 chunk 回传结果：语音则重开 hangover，否则更新噪声底"""
+        if voiced: self._open = self.hangover
+        else: self._track_noise(self._rms)
+    def _track_noise(self, rms: float):
+        a = 0.5 if rms < self.noise_floor else self.noise_alpha
+        self.noise_floor = max(self.abs_floor, (1 - a) * self.noise_floor + a * rms)
+    def stats(self) -> dict:
+        return {"total": self.total, "skipped": self.skipped,
+                "skip_ratio": round(self.skipped / max(self.total, 1), 3),
+                "noise_floor": round(self.noise_floor, 1)}
 
 class SileroVAD:
     _shared_session = None
-    def __init__(self, prob_threshold=0.6):
+    def __init__(self, prob_threshold=0.6, scheduler=None, gate=None):
         self.prob_threshold = prob_threshold
+        self.scheduler = scheduler
+        self.gate = gate
         self._context = np.zeros((1, _CONTEXT_SIZE), dtype=np.float32)
         self._state   = np.zeros((2, 1, 128), dtype=np.float32)
         self._sr      = np.array(_RATE, dtype=np.int64)
@@ -40,43 +148,256 @@ class SileroVAD:
             opts=onnxruntime.SessionOptions(); opts.intra_op_num_threads=opts.inter_op_num_threads=1
             SileroVAD._shared_session=onnxruntime.InferenceSession(_ONNX_PATH, providers=["CPUExecutionProvider"], sess_options=opts)
         return SileroVAD._shared_session
-    def is_speech(self,audio:bytes)->bool:
-        if len(audio)!=_CHUNK_BYTES: return False
+    def _prepare(self,audio:bytes)->np.ndarray:
+        """拼上一帧 context，返回 (1, 640) 模型输入，并推进 context"""
         pcm=np.frombuffer(audio,dtype=np.int16).astype(np.float32)/_MAX_WAV
         inp=np.concatenate((self._context,pcm[np.newaxis,:]),axis=1)
         self._context=inp[:,-_CONTEXT_SIZE:]
-        out,self._state=self.session.run(None,{"input":inp[:,:_CHUNK_SAMPLES+_CONTEXT_SIZE],"state":self._state,"sr":self._sr})
-        return bool(out.squeeze()>=self.prob_threshold)
+        return inp[:,:_CHUNK_SAMPLES+_CONTEXT_SIZE]
+    def speech_prob(self,audio:bytes)->float:
+        if len(audio)!=_CHUNK_BYTES: return 0.0
+        gate=self.gate
+        if gate is not None and gate.should_skip(audio):
+            # 跳过推理时仍推进 context；长时间静音后把循环状态复位到初始值
+            self._skip(audio)
+            if gate.run==gate.reset_after: self.reset_state()
+            return 0.0
+        prob=self._infer(audio)
+        if gate is not None: gate.observe(prob>=self.prob_threshold)
+        return prob
+    def _infer(self,audio:bytes)->float:
+        inp=self._prepare(audio)
+        if self.scheduler is not None: return self.scheduler.infer(self,inp)
+        out,self._state=_offload(self.session.run,None,{"input":inp,"state":self._state,"sr":self._sr})
+        return float(out.squeeze())
+    def _skip(self,audio:bytes):
+        tail=np.frombuffer(audio,dtype=np.int16)[-_CONTEXT_SIZE:]
+        self._context=(tail.astype(np.float32)/_MAX_WAV)[np.newaxis,:]
+    def is_speech(self,audio:bytes)->bool:
+        return self.speech_prob(audio)>=self.prob_threshold
+    def _set_state(self,state:np.ndarray):
+        self._state=state
+    def reset_state(self):
+        self._state=np.zeros((2, 1, 128), dtype=np.float32)
+
+class ZeroAllocSileroVAD(SileroVAD):
+    """
+    零分配热路径：每个连接预分配 input/context/state/output 缓冲，
+    IOBinding 在构造时绑定一次，之后每个 chunk 只做原地写入 + run_with_iobinding。
+    _buf 布局为 [context(128) | pcm(512)]，推理后把尾部 128 样本搬到头部作为下一帧 context。
+    """
+    def __init__(self, prob_threshold=0.6, scheduler=None, gate=None):
+        super().__init__(prob_threshold, scheduler, gate)
+        self._buf       = np.zeros((1, _CONTEXT_SIZE + _CHUNK_SAMPLES), dtype=np.float32)
+        self._pcm16     = np.zeros(_CHUNK_SAMPLES, dtype=np.int16)
+        self._pcm_bytes = memoryview(self._pcm16).cast("B")
+        self._scale     = np.array(_MAX_WAV, dtype=np.float32)
+        self._pcm_view  = self._buf[0, _CONTEXT_SIZE:]
+        self._ctx_view  = self._buf[0, :_CONTEXT_SIZE]
+        self._tail_view = self._buf[0, -_CONTEXT_SIZE:]
+        self._state_out = np.zeros_like(self._state)
+        self._prob      = np.zeros((1, 1), dtype=np.float32)
+        self._binding   = self.session.io_binding()
+        ov = onnxruntime.OrtValue.ortvalue_from_numpy
+        self._bound = [ov(self._buf), ov(self._state), ov(self._sr), ov(self._prob), ov(self._state_out)]
+        self._binding.bind_ortvalue_input("input", self._bound[0])
+        self._binding.bind_ortvalue_input("state", self._bound[1])
+        self._binding.bind_ortvalue_input("sr", self._bound[2])
+        self._binding.bind_ortvalue_output("output", self._bound[3])
+        self._binding.bind_ortvalue_output("stateN", self._bound[4])
+    def _infer(self,audio:bytes)->float:
+        self._pcm_bytes[:]=audio
+        np.divide(self._pcm16,self._scale,out=self._pcm_view)
+        if self.scheduler is not None:
+            prob=self.scheduler.infer(self,self._buf)
+        else:
+            _offload(self.session.run_with_iobinding,self._binding)
+            np.copyto(self._state,self._state_out)
+            prob=self._prob.item()
+        np.copyto(self._ctx_view,self._tail_view)
+        return prob
+    def _skip(self,audio:bytes):
+        self._pcm_bytes[:]=audio
+        np.divide(self._pcm16[-_CONTEXT_SIZE:],self._scale,out=self._ctx_view)
+    def _set_state(self,state:np.ndarray):
+        np.copyto(self._state,state)
+    def reset_state(self):
+        self._state.fill(0)
 
-# Save wav
+class FrameSplitter:
+    """
+    任意大小的 PCM 消息 → 固定 _CHUNK_BYTES (512 样本) 的 VAD 帧。
+    不足一帧的尾巴（含奇数字节）留到下一条消息拼接；整帧直接切 memoryview，不拷贝。
+    """
+    def __init__(self, frame_bytes: int = _CHUNK_BYTES):
+        self.frame_bytes = frame_bytes
+        self._carry = bytearray()
+    def frames(self, data):
+        fb = self.frame_bytes; mv = memoryview(data); off = 0
+        if self._carry:
+            off = min(fb - len(self._carry), len(mv))
+            self._carry += mv[:off]
+            if len(self._carry) < fb: return
+            yield bytes(self._carry); self._carry.clear()
+        end = off + (len(mv) - off) // fb * fb
+        for i in range(off, end, fb): yield mv[i:i + fb]
+        self._carry += mv[end:]
 
-def save_frames_to_wav(frames: List[bytes]) -> str:
-    tmpdir="tmp"; os.makedirs(tmpdir,exist_ok=True)
-    for f in os.listdir(tmpdir): os.remove(os.path.join(tmpdir,f))
-    path=os.path.join(tmpdir,f"asr_{uuid.uuid4().hex}.wav")
-    with wave.open(path,"wb") as wf:
-        wf.setnchannels(1); wf.setsampwidth(2); wf.setframerate(_RATE)
-        wf.writeframes(b"".join(frames))
-    return path
+class VADBatchScheduler:
+    """
+    跨连接批量 VAD：
+    1. 各连接的 greenlet 调 infer() 把 (input, state) 排队后挂起等待；
+    2. 调度 greenlet 在 window_ms 微窗口内收集（最多 max_batch 条），
+       把 input / state 沿 batch 维拼接，只跑一次 session.run；
+       每个 batch 交给 VAD_POOL 执行，不等上一个 batch 跑完就开始收集下一个；
+    3. 把每条的概率与新 state 交还对应连接。
+    同一连接在结果返回前不会再提交，所以一个 batch 内每个 SileroVAD 至多出现一次。
+    """
+    def __init__(self, window_ms: float = VAD_BATCH_WINDOW_MS, max_batch: int = VAD_BATCH_MAX):
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._q = Queue()
+        self._loop = None
+        # 统计
+        self.batches = 0; self.chunks = 0; self.max_batch_seen = 0
+        self.delay_sum = 0.0; self.delay_max = 0.0
+    def infer(self, vad: "SileroVAD", inp: np.ndarray) -> float:
+        if self._loop is None or self._loop.dead:
+            self._loop = gevent.spawn(self._run)
+        res = AsyncResult()
+        self._q.put((vad, inp, time.perf_counter(), res))
+        return res.get()
+    def _run(self):
+        while True:
+            batch = [self._q.get()]
+            deadline = batch[0][2] + self.window
+            while len(batch) < self.max_batch:
+                try: batch.append(self._q.get(timeout=max(deadline - time.perf_counter(), 0)))
+                except Empty: break
+            gevent.spawn(self._run_batch, batch)
+    def _run_batch(self, batch):
+        start = time.perf_counter()
+        try:
+            inp = np.concatenate([b[1] for b in batch], axis=0)
+            state = np.concatenate([b[0]._state for b in batch], axis=1)
+            vad = batch[0][0]
+            out, new_state = _offload(vad.session.run, None, {"input": inp, "state": state, "sr": vad._sr})
+        except Exception as e:
+            logger.error("[VAD batch] inference failed: %s", e, exc_info=True)
+            for _, _, _, res in batch: res.set_exception(e)
+            return
+        for i, (vad, _, _, res) in enumerate(batch):
+            vad._set_state(new_state[:, i:i + 1, :])
+            res.set(float(out[i, 0]))
+        delays = [start - b[2] for b in batch]
+        self.batches += 1; self.chunks += len(batch)
+        self.max_batch_seen = max(self.max_batch_seen, len(batch))
+        self.delay_sum += sum(delays); self.delay_max = max(self.delay_max, max(delays))
+        if self.batches % 1000 == 0: logger.info("[VAD batch] %s", self.stats())
+    def stats(self) -> dict:
+        n = max(self.chunks, 1)
+        return {
+            "batches": self.batches, "chunks": self.chunks,
+            "avg_batch": round(self.chunks / max(self.batches, 1), 2),
+            "max_batch": self.max_batch_seen,
+            "avg_queue_ms": round(self.delay_sum / n * 1000, 3),
+            "max_queue_ms": round(self.delay_max * 1000, 3),
+        }
+
+VAD_SCHEDULER = VADBatchScheduler() if VAD_BATCHING else None
 
-# ASR callback
+# ASR (in-memory)
 
-def _asr_callback(fut, path, ws):
+def _spawn_asr(pcm: bytes, ogg: bytes = None, on_partial=None):
+    """整段 PCM（或 Opus 上行时的 Ogg Opus）直接交给内存版识别，归档（若开启）走旁路线程；
+    识别是全双工 greenlet，不占 EXECUTOR 线程，返回该 greenlet"""
+    if ARCHIVER is not None: ARCHIVER.submit(pcm)
+    if ogg: return gevent.spawn(ASR.recognize_ogg_opus, ogg, on_partial)
+    return gevent.spawn(ASR.recognize_pcm, pcm, on_partial)
+
+def _run_text(on_text, user_text: str):
+    """在 EXECUTOR 里跑对话管线；Future 没人取结果，异常必须在这里记下"""
     try:
-        user_text=fut.result(); logger.info(f"[ASR] {user_text}")
-        handle_user_text(user_text, ws)
+        on_text(user_text)
     except Exception as e:
         logger.error(f"[ASR CALLBACK ERROR] {e}", exc_info=True)
 
+def _submit_text(on_text, user_text: str):
+    EXECUTOR.submit(_run_text, on_text, user_text)
+
+def _submit_asr(pcm: bytes, on_text, ogg: bytes = None, on_partial=None):
+    """识别文本交给 on_text（各连接的 _handle_text）"""
+    _spawn_asr(pcm, ogg, on_partial).link(lambda j: _asr_done(j, on_text))
+
+def _asr_done(job, on_text):
+    if not job.successful():
+        logger.error(f"[ASR ERROR] {job.exception}"); return
+    user_text=job.value; logger.info(f"[ASR] {user_text}")
+    _submit_text(on_text, user_text)
+
+def _stitched_done(user_text, on_text):
+    logger.info(f"[ASR] {user_text}")
+    _submit_text(on_text, user_text)
+
+# Streaming ASR
+
+def _stream_asr_job(q: Queue, on_partial=None) -> str:
+    """一个 utterance 一个 greenlet：建连后把队列里的 PCM 实时送出，收到 None 即结束"""
+    sess = ASR.stream(on_partial).open()
+    try:
+        while True:
+            pcm = q.get()
+            if pcm is None: break
+            sess.feed(pcm)
+        return sess.finish()
+    finally:
+        sess.close()
+
+def _stream_asr_done(job, pcm, on_text, on_partial=None):
+    if job.successful():
+        user_text = job.value; logger.info(f"[ASR stream] {user_text}")
+        if ARCHIVER is not None: ARCHIVER.submit(pcm)
+        _submit_text(on_text, user_text)
+        return
+    # 流式失败时退回整段识别
+    logger.error(f"[ASR stream ERROR] {job.exception}, fallback to whole-utterance ASR")
+    _submit_asr(pcm, on_text, on_partial=on_partial)
+
+def _frame_duration(params: dict) -> int:
+    """hello 声明的 Opus 帧长：只接受 FRAME_DURATIONS 里的值，其余记日志回退 60 ms"""
+    fd=params.get("frame_duration",60)
+    try: fd=int(fd) if not isinstance(fd,bool) else None
+    except (TypeError,ValueError): fd=None
+    if fd not in FRAME_DURATIONS:
+        logger.warning(f"[opus] bad frame_duration={params.get('frame_duration')!r}, use 60"); return 60
+    return fd
+
 # WebSocket app
 class VADASRApp(WebSocketApplication):
     def on_open(self):
-        WS_POOL.add(self.ws); self.vad=SileroVAD(); self.is_talking=False
-        self.buffer=[]; self.silent_start=None; self.window=deque(maxlen=WINDOW_SIZE)
+        WS_POOL.add(self.ws); self.is_talking=False
+        self.gate=EnergyGate(enabled=VAD_GATE)
+        self.vad=(ZeroAllocSileroVAD if VAD_ZERO_ALLOC else SileroVAD)(scheduler=VAD_SCHEDULER, gate=self.gate)
+        self.framer=FrameSplitter(); self.audio=UtteranceBuffer(); self.endpointer=Endpointer()
+        self.labels=shaper.FrameLabels(self.audio.preroll,_CHUNK_BYTES); self._segments=None
+        self._asr_q=None; self._asr_job=None; self.opus=None
+        self.session_id=uuid.uuid4().hex; self._partials=self._partial_sink()
+        message_router.register(self.session_id,self.ws)
+        # 音频帧按到达顺序进有界队列，由本连接的 VAD greenlet 逐帧处理
+        self._audio_q=Queue(maxsize=VAD_MAX_INFLIGHT); self._vad_loop=gevent.spawn(self._run_vad_loop)
         logger.info("✅ 客户端连接，开始监听音频")
+    def _run_vad_loop(self):
+        while True:
+            msg=self._audio_q.get()
+            try:
+                # ("uplink", OpusIngest 或 None)：hello 切换上行编码，排在它之前到达的音频仍按旧编码解
+                if isinstance(msg,tuple): self.opus=msg[1]
+                else: self._process_audio(msg)
+            except Exception as e: logger.error(f"[VAD LOOP ERROR] {e}", exc_info=True)
     def on_message(self,msg):
         if msg is None:
-            WS_POOL.discard(self.ws); logger.info("Connection closed"); return
+            WS_POOL.discard(self.ws); message_router.unregister(self.session_id,self.ws)
+            self._vad_loop.kill(block=False); logger.info("Connection closed"); return
         if isinstance(msg,str):
             try: obj=json.loads(msg); label=obj.get("label")
             except: label=None
@@ -89,54 +410,239 @@ class VADASRApp(WebSocketApplication):
                 def _run():
                     try:
                         answer = process_base64_image(b64img)
-                        append_vision_memory("voicememory", "我看到的图片内容", answer)
+                        append_vision_memory("voicememory", answer)
                         self.ws.send(json.dumps({"label":"chat","reply":"我看到了图片了！"}))
                         logger.info("🖼️ 已保存图像记忆=%s", answer)
-                        mem_dir = os.path.join(os.getcwd(), "voicememory")
-                        vision_path = os.path.join(mem_dir, "visionmemory.txt")
-                        visionmem = open(vision_path, "r", encoding="utf-8").read() if os.path.exists(vision_path) else ""
-                        chat_with_dify(f"$@$系统通知，非聊天：你刚才看到了：{visionmem}，结合之前的记忆回答聊天", user_id="user123", ws=self.ws)
+                        visionmem = memory_cache.snapshot().vision
+                        chat_with_dify(f"$@$系统通知，非聊天：你刚才看到了：{visionmem}，结合之前的记忆回答聊天", user_id="user123", ws=message_router.route(self.session_id))
                     except Exception as e:
                         logger.error("vision fail: %s", e, exc_info=True)
                         self.ws.send(json.dumps({"label":"error","error":str(e)}))
 
                 EXECUTOR.submit(_run)
                 return
+            if label=="hello":
+                # 握手选择上行编码：{"label":"hello","audio_params":{"format":"opus","frame_duration":60}}
+                params=obj.get("audio_params")
+                if not isinstance(params,dict): params={}
+                fmt=params.get("format","pcm")
+                if fmt=="opus" and OPUS_AVAILABLE:
+                    # 无论设备按什么采样率编码，都直接解码成 VAD 需要的 16k 单声道
+                    self._audio_q.put(("uplink",OpusIngest(_RATE,1,_frame_duration(params))))
+                else:
+                    if fmt=="opus": logger.warning("opuslib 不可用，回退 PCM 上行")
+                    self._audio_q.put(("uplink",None)); fmt="pcm"
+                self.ws.send(json.dumps({"label":"hello","audio_params":{"format":fmt,"sample_rate":_RATE,"channels":1}}))
+                return
+            if label=="vad_config":
+                self.gate.configure(**(obj.get("gate") or {}))
+                self.endpointer.configure(**(obj.get("endpoint") or {}))
+                self.ws.send(json.dumps({"label":"vad_config","gate":self.gate.stats(),"endpoint":self.endpointer.stats()}))
+                return
+            if label=="vad_stats":
+                stats=VAD_SCHEDULER.stats() if VAD_SCHEDULER else {}
+                self.ws.send(json.dumps({"label":"vad_stats","stats":stats,"gate":self.gate.stats(),"endpoint":self.endpointer.stats(),"asr":ASR.stats(),"shaper":shaper.STATS.snapshot(),"intent":intent_stats(),"reply":stream_stats(),"http":http_client.stats(),"router":message_router.stats(),"memory":memory_cache.cache().stats()}))
+                return
             if label=="history_request":
-                path="voicememory/voicememory.txt"; lines=[]
-                if os.path.exists(path): lines=[l.strip() for l in open(path,encoding="utf-8")]
+                lines=[l.strip() for l in memory_cache.snapshot().short.splitlines()]
                 self.ws.send(json.dumps({"label":"history","content":"\n".join(lines)}))
                 return
             if label=="text_input":
                 user_text=obj.get("text","" ).strip(); logger.info(f"[on_message] text_input: {user_text}")
                 if user_text:
                     logger.info("[on_message] submitting handle_user_text")
-                    EXECUTOR.submit(handle_user_text, user_text, self.ws)
+                    _submit_text(self._handle_text, user_text)
                 return
             return
-        has_voice=self.vad.is_speech(msg); self.window.append(has_voice)
-        speaking=sum(self.window)>=MIN_VOICE_FRAMES
-        if speaking:
-            if not self.is_talking:
-                self.is_talking=True; self.buffer.clear(); self.silent_start=None
-                logger.info(">>> start speaking"); self.ws.send(json.dumps({"label":"start"}))
-            self.buffer.append(msg)
+        self._audio_q.put(msg)
+    def _process_audio(self,msg):
+        if self.opus is not None:
+            try: msg=self.opus.decode(msg)
+            except Exception as e:
+                logger.warning(f"[opus] bad packet ({len(msg)} B): {e}"); return
+        # 一条消息可能含多帧（或不足一帧），逐帧走完 VAD / 端点
+        for frame in self.framer.frames(msg): self._process_frame(frame)
+    def _process_frame(self,msg):
+        self.audio.write(msg)
+        prob=self.vad.speech_prob(msg)
+        self.labels.write(len(msg),prob>=self.endpointer.offset)
+        event=self.endpointer.update(prob,len(msg)*1000/(_RATE*2))
+        if event=="start":
+            self.is_talking=True; self.audio.start(); self.labels.start()
+            if self.opus is not None: self.opus.start()
+            logger.info(">>> start speaking"); self._notify("start")
+            if ASR_STREAMING and ASR.supports_streaming:
+                # pre-roll（已含当前帧）作为流式会话的第一段音频
+                self._asr_q=Queue(); self._asr_job=gevent.spawn(_stream_asr_job,self._asr_q,self._partials.segment(0))
+                self._asr_q.put(bytes(self.audio.view()))
+            return
+        if not self.is_talking: return
+        if self._asr_q is not None: self._asr_q.put(msg)
+        if event=="end":
+            logger.info("<<< end speaking, ASR (%.0f ms speech)", self.endpointer.last_speech_ms); self._end_utterance()
+        elif self._asr_job is None and shaper.SEG_ENABLE and (self.audio.full or (
+                len(self.audio)>=shaper.SEG_MAX_MS*32 and self.endpointer.silence_ms>=shaper.SEG_PAUSE_MS)):
+            self._split_segment()
+        elif self.audio.full:
+            logger.info("<<< max utterance length reached, ASR"); self.endpointer.reset(); self._end_utterance()
+    def _end_utterance(self):
+        self.is_talking=False
+        self._notify("finish")
+        # 已切出的各段与当前段的中间结果按段序拼接后的整句文本
+        event_bus.publish("speech_end",session=self.session_id,text=self._partials.text)
+        on_text,partials=self._handle_text,self._partials
+        self._partials=self._partial_sink()
+        if self._asr_job is not None:
+            pcm=self.audio.take(); self.labels.reset()
+            if self.opus is not None: self.opus.take()
+            self._asr_q.put(None)
+            self._asr_job.link(lambda job:_stream_asr_done(job,pcm,on_text,partials.segment(0)))
+            self._asr_q=None; self._asr_job=None
         else:
-            if self.is_talking:
-                if not self.silent_start: self.silent_start=time.time()
-                self.buffer.append(msg)
-                if time.time()-self.silent_start>=_SILENCE_THRESHOLD:
-                    self.is_talking=False; logger.info("<<< end speaking, ASR")
-                    self.ws.send(json.dumps({"label":"finish"}))
-                    path=save_frames_to_wav(self.buffer)
-                    fut=EXECUTOR.submit(asr_once,path)
-                    fut.add_done_callback(lambda f:_asr_callback(f,path,self.ws))
-                    self.buffer.clear(); self.silent_start=None
+            self._submit_segment(partials)
+            segments,self._segments=self._segments,None
+            segments.close(); shaper.STATS.utterances+=1
+    def _split_segment(self):
+        """长句在停顿处（或缓冲写满时）切段：已录部分先送识别，本句继续采集，段间不重叠"""
+        logger.info("--- split segment %d (%.0f ms)", len(self._segments or ())+1, len(self.audio)/32)
+        self._submit_segment(self._partials); shaper.STATS.splits+=1
+        self.audio.start(preroll=False); self.labels.start(preroll=False)
+        if self.opus is not None: self.opus.start(preroll=False)
+    def _submit_segment(self,partials):
+        """取出当前段，按 VAD 标签裁掉首尾非语音后提交识别，登记到本句的拼接器；中间结果记在 partials 的同序号段"""
+        pcm=self.audio.take(); packets=self.opus.take() if self.opus is not None else None
+        lo,hi=self.labels.bounds(len(pcm)); self.labels.reset()
+        shaper.STATS.record(len(pcm),hi-lo)
+        ogg=None
+        if packets and ASR_UPLOAD_OPUS and ASR.accepts_ogg_opus:
+            packets=shaper.trim_packets(packets,len(pcm),lo,hi,self.opus.frame_duration*32)
+            ogg=self.opus.to_ogg(packets)
+        if lo or hi<len(pcm): pcm=pcm[lo:hi]
+        if self._segments is None:
+            on_text=self._handle_text
+            self._segments=shaper.SegmentStitcher(lambda text:_stitched_done(text,on_text))
+        self._segments.add(_spawn_asr(pcm,ogg,partials.segment()))
+    def _notify(self,label,**fields):
+        """开口 / 收音结束 / 中间识别结果通知前端"""
+        self.ws.send(json.dumps({"label":label,**fields},ensure_ascii=False))
+    def _partial_sink(self):
+        """
+        每句一个 PartialText：各段中间结果按段序拼成整句，变化时推给前端并发布到事件总线。
+        句子结束后上一句的识别可能还在出中间结果，照常推送，但它们记在上一句的 PartialText 里，不影响当前句。
+        """
+        def publish(text):
+            self._notify("asr_partial",text=text)
+            event_bus.publish("asr_partial",session=self.session_id,text=text)
+        return shaper.PartialText(publish)
+    def _handle_text(self,user_text):
+        """识别结果进入对话管线（在 EXECUTOR 线程里调用）；回复按 session 经 message_router 投递回本连接"""
+        handle_user_text(user_text,message_router.route(self.session_id),conn_session=self.session_id)
     def on_close(self,reason):
-        WS_POOL.discard(self.ws); logger.info(f"⚠️ 关闭: {reason}")
+        WS_POOL.discard(self.ws); message_router.unregister(self.session_id,self.ws); self._vad_loop.kill(block=False)
+        if self._asr_job is not None: self._asr_job.kill(block=False)
+        logger.info(f"⚠️ 关闭: {reason} | gate={self.gate.stats()}")
+
+class XiaozhiApp(VADASRApp):
+    """
+    小智 ESP32 固件原生协议（docs/websocket.md），设备直连、不再经 /vad_asr 的桥接转发：
+    - hello 握手协商 Opus 上行，回 session_id；listen start/stop 控制收音，abort 打断当前回复；
+    - auto / realtime 由服务器 VAD + 端点断句；manual 由设备 listen stop 断句，跳过服务器 VAD；
+    - realtime 回复期间继续收音，检测到开口即打断（barge-in）；
+    - 下行 stt → tts start → 回复 (sentence_start / llm 表情) → tts stop，
+      管线里的 label 消息经 xiaozhi_protocol.XiaozhiSink 翻译；回复文本 / 表情由 llm_client、emotion_controller
+      经 message_router.send(ws) 发给传入的 ws，即这里的 sink，不走 /vad_asr 的 session 路由。
+    listen 事件与音频走同一个队列，保证 stop 之前到达的音频都已处理。
+    """
+    def on_open(self):
+        super().on_open()
+        self.mode="auto"
+        self.listening=False; self.speaking=False; self.turn=0; self.iot={}
+        self.uplink_opus=False   # 接收侧是否已收到 hello；self.opus 由 VAD greenlet 切换
+        self._turn_lock=threading.Lock()
+        if not xz.check_auth(self.ws.environ):
+            logger.warning("[xiaozhi] 鉴权失败，断开"); self.ws.close()
+    def send_json(self,obj):
+        try: self.ws.send(json.dumps(obj,ensure_ascii=False))
+        except Exception as e: logger.warning(f"[xiaozhi] send failed: {e}")
+    def on_message(self,msg):
+        if msg is None: return super().on_message(msg)
+        if not isinstance(msg,str):
+            # 设备只在监听状态下的音频才有意义
+            if self.listening and self.uplink_opus: self._audio_q.put(msg)
+            return
+        try: obj=json.loads(msg)
+        except ValueError: logger.warning(f"[xiaozhi] bad json: {msg[:80]}"); return
+        kind=obj.get("type")
+        if kind=="hello":
+            if not OPUS_AVAILABLE:
+                logger.error("[xiaozhi] 需要 Opus 解码：pip install opuslib"); self.ws.close(); return
+            params=obj.get("audio_params")
+            fd=_frame_duration(params if isinstance(params,dict) else {})
+            # 与 listen 一样经 _audio_q 生效，VAD greenlet 处理到这里时才换解码器
+            self._audio_q.put(("uplink",OpusIngest(_RATE,1,fd))); self.uplink_opus=True
+            self.send_json(xz.hello(self.session_id,_RATE,fd))
+        elif kind=="listen":
+            state=obj.get("state")
+            if state=="start":
+                mode=obj.get("mode","auto"); self.mode=mode if mode in xz.LISTEN_MODES else "auto"
+                self.listening=True; self._audio_q.put("start")
+            elif state=="stop":
+                self.listening=False; self._audio_q.put("stop")
+            elif state=="detect":
+                logger.info(f"[xiaozhi] wake word: {obj.get('text','')}")
+        elif kind=="abort":
+            self._abort(obj.get("reason",""))
+        elif kind=="iot":
+            for key in ("descriptors","states"):
+                if key in obj: self.iot[key]=obj[key]
+        else:
+            logger.info(f"[xiaozhi] ignore type={kind}")
+    def _process_audio(self,msg):
+        if isinstance(msg,str): return self._on_listen(msg)
+        if self.mode!="manual": return super()._process_audio(msg)
+        # manual：设备自己断句，解码后直接进缓冲，不跑 VAD
+        try: pcm=self.opus.decode(msg)
+        except Exception as e:
+            logger.warning(f"[opus] bad packet ({len(msg)} B): {e}"); return
+        self.audio.write(pcm)
+        if self.audio.full:
+            if shaper.SEG_ENABLE: self._split_segment()
+            else: logger.info("<<< max utterance length reached, ASR"); self._end_utterance()
+    def _on_listen(self,state):
+        if state=="start":
+            if self.is_talking: return
+            self.endpointer.reset()
+            if self.mode=="manual":
+                self.is_talking=True; self.audio.start(preroll=False); self.opus.start(preroll=False)
+                self.labels.start(preroll=False)
+                logger.info(">>> listen start (manual)")
+        elif state=="stop" and self.is_talking:
+            logger.info("<<< listen stop, ASR"); self.endpointer.reset(); self._end_utterance()
+    def _notify(self,label,**fields):
+        # 设备不需要 start/finish/asr_partial；realtime 下开口即打断正在进行的回复
+        if label=="start" and self.mode=="realtime" and self.speaking: self._abort("barge_in")
+    def _next_turn(self):
+        # abort 在 hub 上、_handle_text 在 EXECUTOR 里，都会开新一轮：自增加锁，保证两边不会拿到同一个轮次；
+        # XiaozhiSink.live 只读 self.turn（单次属性读），不需要锁
+        with self._turn_lock:
+            self.turn+=1; return self.turn
+    def _abort(self,reason):
+        self._next_turn(); logger.info(f"[xiaozhi] abort: {reason}")
+        if self.speaking:
+            self.speaking=False; self.send_json(xz.tts(self.session_id,"stop"))
+    def _handle_text(self,user_text):
+        if not user_text or not user_text.strip(): return
+        sink=xz.XiaozhiSink(self,self._next_turn())
+        self.send_json(xz.stt(self.session_id,user_text))
+        self.speaking=True; self.send_json(xz.tts(self.session_id,"start"))
+        try: handle_user_text(user_text,sink,conn_session=self.session_id)
+        finally:
+            if sink.live:
+                self.speaking=False; self.send_json(xz.tts(self.session_id,"stop"))
 
 if __name__=='__main__':
     logger.info("🚀 服务启动：:5001")
     # start_cleanup_scheduler()     
-    server=WebSocketServer(('0.0.0.0',5001),Resource({'/vad_asr':VADASRApp}))
+    ASR.start()  # 预热：豆包连接池 / 本地模型加载
+    server=WebSocketServer(('0.0.0.0',5001),Resource({'/vad_asr':VADASRApp,'/xiaozhi/v1':XiaozhiApp}))
     server.serve_forever()
\ No newline at end of file
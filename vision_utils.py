@@ -1,5 +1,6 @@
 import atexit
-import os, uuid, time, base64, requests, logging
+import os, uuid, time, base64, logging
+import http_client
 from io import BytesIO
 from PIL import Image
 from apscheduler.schedulers.gevent import GeventScheduler   # ← 重点
@@ -37,11 +38,7 @@ def start_cleanup_scheduler():
 
 # ─────────────────── 基础步骤封装 ───────────────────
 def build_prompt():
-    mem_dir = os.path.join(os.getcwd(), "voicememory")
-    os.makedirs(mem_dir, exist_ok=True)
-    # fallback to Dify
-    epi = open(os.path.join(mem_dir, "Episodicmemory.txt"), "r", encoding="utf-8").read() if os.path.exists(os.path.join(mem_dir, "Episodicmemory.txt")) else ""
-    short = open(os.path.join(mem_dir, "voicememory.txt"), "r", encoding="utf-8").read() if os.path.exists(os.path.join(mem_dir, "voicememory.txt")) else ""
+    # 看图 prompt 不带记忆；需要时取 memory_cache.snapshot()，不要在这里读盘
     prompt = f"非常详细而且富有创造力的描述图片的内容，对看到的人脸需要做详细描述，可以发挥想象和创意里面都有什么"
     return prompt
 def _decode_and_resize(b64: str) -> Tuple[bytes, str]:
@@ -85,7 +82,8 @@ def _ask_vision_llm(public_url: str) -> str:
             }
         ]
     }
-    r = requests.post(
+    r = http_client.post(
+        "vision",
         ARK_REGION,
         headers={"Authorization": f"Bearer {ARK_API_KEY}",
                  "Content-Type": "application/json"},
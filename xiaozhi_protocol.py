@@ -0,0 +1,98 @@
+# xiaozhi_protocol.py
+# 小智 ESP32 固件 WebSocket 协议（esp32_front_end/xiaozhi-esp32-main/docs/websocket.md）的服务器侧消息。
+# 会话状态机在 vad_asr.XiaozhiApp，这里只管 JSON 形状：
+#   上行 hello / listen / abort / iot；下行 hello / stt / llm / tts
+#   XIAOZHI_TOKEN        设置后校验握手头 Authorization: Bearer <token>
+#   XIAOZHI_FACE_EMOTION 表情序号到小智表情名的映射，如 "1:happy,2:sad,3:angry"；未列出的用 neutral
+
+import os
+import json
+import logging
+from typing import Optional
+
+logger = logging.getLogger("xiaozhi")
+
+XIAOZHI_TOKEN = os.getenv("XIAOZHI_TOKEN", "")
+LISTEN_MODES = ("auto", "manual", "realtime")
+DEFAULT_EMOTION = "neutral"
+
+
+def _parse_face_map(spec: str) -> dict:
+    faces = {}
+    for item in spec.split(","):
+        if ":" in item:
+            k, v = item.split(":", 1)
+            faces[int(k)] = v.strip()
+    return faces
+
+FACE_EMOTION = _parse_face_map(os.getenv("XIAOZHI_FACE_EMOTION", ""))
+
+
+def check_auth(environ: dict) -> bool:
+    if not XIAOZHI_TOKEN:
+        return True
+    return environ.get("HTTP_AUTHORIZATION", "") == f"Bearer {XIAOZHI_TOKEN}"
+
+
+def hello(session_id: str, sample_rate: int, frame_duration: int) -> dict:
+    return {"type": "hello", "transport": "websocket", "session_id": session_id,
+            "audio_params": {"format": "opus", "sample_rate": sample_rate,
+                             "channels": 1, "frame_duration": frame_duration}}
+
+
+def stt(session_id: str, text: str) -> dict:
+    return {"type": "stt", "session_id": session_id, "text": text}
+
+
+def tts(session_id: str, state: str, text: str = None) -> dict:
+    msg = {"type": "tts", "session_id": session_id, "state": state}
+    if text is not None:
+        msg["text"] = text
+    return msg
+
+
+def translate(payload: dict, session_id: str) -> Optional[dict]:
+    """把管线里的 {"label":...} 下行翻译成小智消息；设备不认识的返回 None"""
+    label = payload.get("label")
+    if label == "chat":
+        # 流式回复已按句下发过，整段 reply 只是结束标记
+        if payload.get("streamed"):
+            return None
+        return tts(session_id, "sentence_start", payload.get("reply", ""))
+    if label == "chat_sentence":
+        return tts(session_id, "sentence_start", payload.get("text", ""))
+    if label == "emotion":
+        faces = payload.get("faces") or []
+        emotion = FACE_EMOTION.get(faces[0], DEFAULT_EMOTION) if faces else DEFAULT_EMOTION
+        return {"type": "llm", "session_id": session_id, "emotion": emotion}
+    if label == "function":
+        # 固件没有对应类型，原样带给设备日志，不影响状态机
+        return {"type": "function", "session_id": session_id, "name": payload.get("name"),
+                "arguments": payload.get("arguments"), "result": payload.get("result")}
+    return None
+
+
+class XiaozhiSink:
+    """
+    交给 handle_user_text 当作 ws 用：send() 收到的 label 消息翻译后发给设备。
+    每轮回复一个 sink；轮次被 abort 或新一轮取代后 live 为 False，迟到的消息直接丢弃。
+    """
+
+    def __init__(self, app, turn: int):
+        self.app = app
+        self.turn = turn
+
+    @property
+    def live(self) -> bool:
+        return self.app.turn == self.turn
+
+    def send(self, data):
+        if not self.live:
+            return
+        try:
+            payload = json.loads(data) if isinstance(data, (str, bytes)) else data
+        except ValueError:
+            return
+        msg = translate(payload, self.app.session_id)
+        if msg is not None:
+            self.app.send_json(msg)